@@ -0,0 +1,95 @@
+import numpy as np
+from matplotlib.colors import to_rgba
+
+# Bits of AnalyzerState.flags
+EMITTER = 1
+VISIBLE = 2
+ALERT = 4
+
+
+class AnalyzerState:
+    """
+    Per-band state of a spectrum analyzer held in preallocated float32 arrays.
+
+    Every array has one entry per band and is allocated once, update paths
+    write into them in place.
+
+    ...
+
+    Attributes
+    ----------
+    num_bands : int
+        number of bands
+    noise_floor : float
+        amplitude of the noise floor
+    amplitudes : numpy.ndarray
+        float32 amplitude of each band
+    heights : numpy.ndarray
+        float32 scratch buffer for the bar heights drawn each frame
+    thresholds : numpy.ndarray
+        float32 amplitude at which each band counts as transmitting, np.inf for
+        bands that are not monitored
+    colors : numpy.ndarray
+        float32 RGBA color of each bar, shape (num_bands, 4)
+    flags : numpy.ndarray
+        uint8 bit flags of each band, a combination of EMITTER, VISIBLE and ALERT
+
+    Methods
+    -------
+    reset():
+        Puts every band back on the noise floor.
+
+    set_flag(indices, flag, value=True):
+        Sets or clears a flag on the given bands.
+
+    flagged(flag):
+        Returns the indices of the bands with the given flag set.
+    """
+    __slots__ = ('num_bands', 'noise_floor', 'amplitudes', 'heights', 'thresholds', 'colors', 'flags')
+
+    def __init__(self, num_bands, noise_floor=200, threshold=np.inf, color='red'):
+        self.num_bands = int(num_bands)
+        self.noise_floor = float(noise_floor)
+        self.amplitudes = np.empty(self.num_bands, dtype=np.float32)
+        self.heights = np.empty(self.num_bands, dtype=np.float32)
+        self.thresholds = np.full(self.num_bands, threshold, dtype=np.float32)
+        self.colors = np.empty((self.num_bands, 4), dtype=np.float32)
+        self.colors[:] = to_rgba(color)
+        self.flags = np.zeros(self.num_bands, dtype=np.uint8)
+        self.reset()
+
+    def reset(self):
+        """
+        Puts every band back on the noise floor.
+        """
+        self.amplitudes.fill(self.noise_floor)
+        self.heights.fill(self.noise_floor)
+
+    def set_flag(self, indices, flag, value=True):
+        """
+        Sets or clears a flag on the given bands.
+
+        Parameters
+        ----------
+        indices : int, array of int or array of bool
+            the bands to change
+        flag : int
+            one of EMITTER, VISIBLE or ALERT
+        value : bool
+            whether to set or clear the flag
+        """
+        if value:
+            self.flags[indices] |= flag
+        else:
+            self.flags[indices] &= ~np.uint8(flag)
+
+    def flagged(self, flag):
+        """
+        Returns the indices of the bands with the given flag set.
+
+        Parameters
+        ----------
+        flag : int
+            one of EMITTER, VISIBLE or ALERT
+        """
+        return np.flatnonzero(self.flags & flag)
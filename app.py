@@ -1,26 +1,650 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, abort, render_template, request, jsonify, make_response, send_file, url_for
 from spectrum_analyzer import SpectrumAnalyzer
+from spectrum_render import FigurePool, render_image
+from render_cache import DiskCache, LRUCache, SingleFlight
+from live_feed import LiveSpectrum
+from render_workers import RenderPool, RenderPoolFull
+from export_jobs import DONE, JobQueue, JobQueueFull
+from concurrent.futures import ThreadPoolExecutor
 import base64
+import hashlib
+import inspect
 import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 
 app = Flask(__name__)
 
+# Rendered images and their ETags keyed on their normalized options and format
+image_cache = LRUCache(maxsize=128)
+
+# Renders shared by every worker process of the app, checked after image_cache
+disk_cache = DiskCache(
+    os.environ.get('SPECTRUM_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'spectrum-render-cache')),
+    max_bytes=int(os.environ.get('SPECTRUM_CACHE_BYTES', 256 * 2**20)),
+)
+
+IMAGE_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+
+EXPORT_TYPES = {'gif': 'image/gif', 'apng': 'image/apng', 'webp': 'image/webp'}
+
+# Resolutions exports may be rendered at, 200 dpi is already a 1280x960 frame
+MIN_EXPORT_DPI = 10
+MAX_EXPORT_DPI = 200
+# Exports run in the background and may be longer than an image request, 12000 frames is 10 minutes at 20 fps
+EXPORT_MAX_FRAMES = int(os.environ.get('SPECTRUM_EXPORT_MAX_FRAMES', 12000))
+
+
+def remove_export(job):
+    """
+    Deletes the file of an expired unseeded export job, seeded exports stay in
+    disk_cache for whoever asks for them next.
+    """
+    if job.status == DONE and job.info['options']['seed'] is None:
+        try:
+            os.remove(job.result)
+        except FileNotFoundError:
+            pass
+
+
+# Animation exports run in the background, a request only submits or polls them
+export_jobs = JobQueue(
+    max_workers=int(os.environ.get('SPECTRUM_EXPORT_WORKERS', 2)),
+    max_queued=int(os.environ.get('SPECTRUM_EXPORT_QUEUE', 16)),
+    retention=float(os.environ.get('SPECTRUM_EXPORT_RETENTION', 3600)),
+    on_expire=remove_export,
+)
+
+# One running simulation per set of options, shared by all of its viewers
+live_feeds = {}
+live_feeds_lock = threading.Lock()
+# Seconds a feed is kept without viewers, long enough for a new viewer to subscribe
+LIVE_FEED_GRACE = 30
+
+# Identical renders requested at the same time are only rendered once
+render_flights = SingleFlight()
+
+# Figures reused across requests instead of building one per render
+figure_pool = FigurePool(max_idle=8)
+
+# Worker processes images are rendered in, started by start_render_pool when
+# the server starts. Every app process gets its own pool, so keep this small
+# when running several app processes. With SPECTRUM_RENDER_PROCESSES=0 images
+# are rendered in the request thread.
+RENDER_PROCESSES = int(os.environ.get('SPECTRUM_RENDER_PROCESSES', 2))
+RENDER_QUEUE = int(os.environ.get('SPECTRUM_RENDER_QUEUE', 32))
+render_pool = None
+render_pool_lock = threading.Lock()
+
+# Largest number of option sets /batch renders in one request
+BATCH_LIMIT = int(os.environ.get('SPECTRUM_BATCH_LIMIT', 500))
+# Batch items are handed to the render workers from these threads. Without
+# workers renders take spectrum_render.DRAW_LOCK, so one thread is enough.
+batch_executor = ThreadPoolExecutor(max(RENDER_PROCESSES, 1), thread_name_prefix='batch')
+
+
+def _int_list(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    return [int(v) for v in value]
+
+
+def _optional_int(value):
+    return None if value is None or value == '' else int(value)
+
+
+def _seed(value):
+    value = _optional_int(value)
+    if value is not None and value < 0:
+        raise ValueError(f'seed must not be negative, not {value}')
+    return value
+
+
+def _renderer(value):
+    if value not in ('bars', 'collection'):
+        raise ValueError(f"renderer must be 'bars' or 'collection', not {value!r}")
+    return value
+
+
+OPTION_TYPES = {
+    'min_frequency': int,
+    'max_frequency': int,
+    'min_amplitude': int,
+    'max_amplitude': int,
+    'num_bands': int,
+    'visible_bands': _int_list,
+    'noise_floor': _int_list,
+    'num_frames': int,
+    'seed': _seed,
+    'renderer': _renderer,
+}
+
+
+# Largest analyzers the web routes build, far beyond what a plot can show
+MAX_BANDS = 20000
+MAX_FRAMES = 2000
+# Frequencies and amplitudes end up in int32 frames and grids
+MAX_VALUE = 2 ** 31 - 1
+BOUNDED_OPTIONS = ('min_frequency', 'max_frequency', 'min_amplitude', 'max_amplitude', 'visible_bands', 'noise_floor')
+
+
+def normalize_options(options_data, max_frames=MAX_FRAMES):
+    """
+    Fills in the SpectrumAnalyzer defaults for missing options and converts the
+    rest to the types the constructor expects.
+
+    Two requests asking for the same analyzer normalize to equal dicts, however
+    their values were spelled (e.g. "5" and 5, or "200,400" and [200, 400]).
+
+    Raises ValueError for bodies that are not a dict, unknown options, values
+    that cannot be converted and combinations the analyzer cannot be built
+    with. num_frames is bounded to 1..max_frames.
+    """
+    if options_data is None:
+        options_data = {}
+    if not isinstance(options_data, dict):
+        raise ValueError('options must be a JSON object')
+    unknown = set(options_data) - set(OPTION_TYPES)
+    if unknown:
+        raise ValueError(f'unknown options: {", ".join(sorted(unknown))}')
+
+    parameters = inspect.signature(SpectrumAnalyzer).parameters
+    options = {}
+    for name, convert in OPTION_TYPES.items():
+        value = options_data.get(name, parameters[name].default)
+        try:
+            options[name] = convert(value)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ValueError(f'invalid value for {name}: {e}')
+    for name in BOUNDED_OPTIONS:
+        values = options[name] if isinstance(options[name], list) else [options[name]]
+        if any(not -MAX_VALUE <= value <= MAX_VALUE for value in values):
+            raise ValueError(f'{name} must be between {-MAX_VALUE} and {MAX_VALUE}')
+
+    if options['min_frequency'] >= options['max_frequency']:
+        raise ValueError(f"min_frequency ({options['min_frequency']}) must be less than max_frequency ({options['max_frequency']})")
+    if options['min_amplitude'] > options['max_amplitude']:
+        raise ValueError(f"min_amplitude ({options['min_amplitude']}) is greater than max_amplitude ({options['max_amplitude']})")
+    if not 1 <= options['num_bands'] <= MAX_BANDS:
+        raise ValueError(f"num_bands must be between 1 and {MAX_BANDS}, not {options['num_bands']}")
+    if options['num_bands'] < len(options['visible_bands']):
+        raise ValueError(f"num_bands ({options['num_bands']}) is smaller than the number of visible bands ({len(options['visible_bands'])})")
+    if not options['noise_floor']:
+        raise ValueError('noise_floor needs at least one value')
+    if not 1 <= options['num_frames'] <= max_frames:
+        raise ValueError(f"num_frames must be between 1 and {max_frames}, not {options['num_frames']}")
+    return options
+
+
+def options_key(options):
+    """
+    Returns a hashable cache key for a normalized options dict.
+    """
+    return json.dumps(options, sort_keys=True)
+
+
+def render_key(kind, options, **settings):
+    """
+    Returns the disk_cache key of a render: what is rendered, the normalized
+    options of the analyzer and every setting that changes the output, such
+    as the format and size.
+    """
+    return {'kind': kind, 'options': options, **settings}
+
+
+def render_options(options, format='png'):
+    """
+    Returns the image of a SpectrumAnalyzer built with the given normalized
+    options, together with its ETag, rendering it only when neither this
+    process nor disk_cache has it. Requests for an image that is already being
+    rendered wait for that render instead of starting their own.
+
+    Renders run in the render worker pool, RenderPoolFull is raised when it
+    has no room for another one.
+
+    Parameters
+    ----------
+    options : dict
+        options returned by normalize_options
+    format : str
+        one of the IMAGE_TYPES formats
+
+    Returns
+    -------
+    data : bytes
+        the encoded image
+    etag : str
+        hash of the image bytes
+    """
+    key = (options_key(options), format)
+    cached = image_cache.get(key)
+    if cached is None:
+        cached = render_flights.do(('image',) + key, _render_image, key, options, format)
+    return cached
+
+
+def start_render_pool():
+    """
+    Starts the render worker pool so its processes are spawned and warm before
+    the first request. Called when the server starts, in each app process:
+    from __main__ for the development server and from the post_fork hook in
+    gunicorn.conf.py under gunicorn.
+    """
+    return get_render_pool()
+
+
+def get_render_pool():
+    """
+    Returns the render worker pool, starting it now if start_render_pool was
+    not called, or None when rendering in worker processes is turned off.
+    """
+    global render_pool
+    if RENDER_PROCESSES <= 0:
+        return None
+    with render_pool_lock:
+        if render_pool is None:
+            render_pool = RenderPool(RENDER_PROCESSES, max_pending=RENDER_QUEUE)
+    return render_pool
+
+
+def _render_image(key, options, format):
+    disk_key = render_key('image', options, format=format)
+    data = disk_cache.get(disk_key)
+    if data is None:
+        pool = get_render_pool()
+        if pool is not None:
+            data = pool.render(options, format)
+        else:
+            # Process the options and create a SpectrumAnalyzer instance with the given options
+            analyzer = SpectrumAnalyzer(**options, figure_pool=figure_pool)
+            try:
+                data = render_image(analyzer.fig, format=format)
+            finally:
+                analyzer.release_figure()
+        disk_cache.put(disk_key, data)
+    cached = (data, hashlib.sha256(data).hexdigest())
+    image_cache.put(key, cached)
+    return cached
+
+
+def export_animation(options, format='gif', dpi=80, optimize=False, progress=None):
+    """
+    Returns the path of an animation of num_frames random frames of a
+    SpectrumAnalyzer built with the given normalized options.
+
+    Seeded exports are kept in disk_cache and only rendered when it does not
+    have them. Exports already being rendered are waited for, only the first
+    caller's progress is reported. Without a seed every export has different
+    frames, so unseeded exports are rendered every time into a temporary file
+    of their own, which remove_export deletes when the job expires.
+
+    Parameters
+    ----------
+    options : dict
+        options returned by normalize_options
+    format : str
+        'gif', 'apng' or 'webp'
+    dpi : int
+        dots per inch of the frames
+    optimize : bool
+        write a frame-differenced GIF
+    progress : callable, optional
+        called as progress(frames_written, num_frames) while rendering
+    """
+    if options['seed'] is None:
+        return _render_animation(options, format, dpi, optimize, progress)
+    key = render_key('animation', options, format=format, dpi=dpi, optimize=optimize)
+    return render_flights.do(options_key(key), _export_animation, key, options, format, dpi, optimize, progress)
+
+
+def _export_animation(key, options, format, dpi, optimize, progress):
+    path = disk_cache.path(key)
+    if path is not None:
+        return path
+    return disk_cache.put_file(key, _render_animation(options, format, dpi, optimize, progress))
+
+
+def _render_animation(options, format, dpi, optimize, progress):
+    fd, temp_name = tempfile.mkstemp(prefix='spectrum-export-', suffix='.' + format)
+    os.close(fd)
+    try:
+        analyzer = SpectrumAnalyzer(**options, figure_pool=figure_pool)
+        try:
+            analyzer.save_spectrum_gif(temp_name, dpi=dpi, optimize=optimize, progress=progress)
+        finally:
+            analyzer.release_figure()
+    except BaseException:
+        os.remove(temp_name)
+        raise
+    return temp_name
+
+
+def render_batch_item(options, format, timeout=30):
+    """
+    Renders one image of a batch like render_options, but waits for room in
+    the render worker pool instead of giving up at once, since a batch would
+    otherwise fill the pool itself. RenderPoolFull is only raised after
+    timeout seconds without room.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        try:
+            return render_options(options, format)
+        except RenderPoolFull:
+            if time.monotonic() + delay > deadline:
+                raise
+            time.sleep(delay)
+            delay = min(2 * delay, 0.5)
+
+
+def get_live_feed(options):
+    """
+    Returns the live feed for the given normalized options, starting a new one
+    when no viewer is watching these options yet. Feeds nobody has watched for
+    LIVE_FEED_GRACE seconds are dropped.
+    """
+    key = options_key(options)
+    with live_feeds_lock:
+        # The grace period keeps a feed whose viewer has not subscribed yet
+        for idle_key in [k for k, feed in live_feeds.items() if k != key and feed.idle_for > LIVE_FEED_GRACE]:
+            del live_feeds[idle_key]
+        feed = live_feeds.get(key)
+        if feed is None:
+            feed = live_feeds[key] = LiveSpectrum(SpectrumAnalyzer(**options))
+    return feed
+
+
+def sse_event(event, data, id=None):
+    """
+    Formats one Server-Sent Events message.
+    """
+    message = f'event: {event}\n'
+    if id is not None:
+        message += f'id: {id}\n'
+    return message + f'data: {data}\n\n'
+
+
+def busy(message='too many renders in progress, try again shortly', retry_after=1):
+    """
+    Returns the 503 response sent when the render workers or export jobs are
+    saturated.
+    """
+    response = jsonify({'error': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/options', methods=['POST'])
 def options():
-    options_data = request.get_json()
-    # Process the options_data and create a SpectrumAnalyzer instance with the given options
-    analyzer = SpectrumAnalyzer(options_data)
+    try:
+        options_data = normalize_options(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Get the generated image and convert it to base64
-    buf = io.BytesIO()
-    analyzer.fig.savefig(buf, format='png')
-    image_base64 = base64.b64encode(buf.getvalue()).decode('utf-8').replace('\n', '')
+    try:
+        data, _ = render_options(options_data)
+    except RenderPoolFull:
+        return busy()
+    image_base64 = base64.b64encode(data).decode('utf-8')
 
     return jsonify({'image': image_base64})
 
+@app.route('/spectrum.<format>')
+def spectrum_image(format):
+    """
+    Returns the image for the options in the query string as raw PNG or WebP
+    bytes. Clients that send the ETag back in If-None-Match get a 304 while
+    the image is unchanged.
+    """
+    if format not in IMAGE_TYPES:
+        abort(404)
+    try:
+        options_data = normalize_options(request.args.to_dict())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        data, etag = render_options(options_data, format)
+    except RenderPoolFull:
+        return busy()
+    response = make_response(data)
+    response.mimetype = IMAGE_TYPES[format]
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/exports', methods=['POST'])
+def submit_export():
+    """
+    Queues an animation export and returns its job with 202 Accepted.
+
+    The JSON body holds the analyzer 'options' as for /options, and optionally
+    the 'format' (gif, apng or webp), 'dpi' and 'optimize' of the animation.
+    The job is polled at /exports/<id> and its file downloaded from
+    /exports/<id>/download once it is done.
+    """
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    try:
+        if not isinstance(body, dict):
+            raise ValueError('the body must be a JSON object')
+        # Bounds num_frames to 1..EXPORT_MAX_FRAMES, an animation needs at least one frame
+        options_data = normalize_options(body.get('options'), max_frames=EXPORT_MAX_FRAMES)
+        format = body.get('format', 'gif')
+        if not isinstance(format, str) or format not in EXPORT_TYPES:
+            raise ValueError(f'format must be one of {", ".join(EXPORT_TYPES)}, not {format!r}')
+        dpi = int(body.get('dpi', 80))
+        if not MIN_EXPORT_DPI <= dpi <= MAX_EXPORT_DPI:
+            raise ValueError(f'dpi must be between {MIN_EXPORT_DPI} and {MAX_EXPORT_DPI}, not {dpi}')
+        optimize = body.get('optimize', False)
+        if not isinstance(optimize, bool):
+            raise ValueError(f'optimize must be true or false, not {optimize!r}')
+        if optimize and format != 'gif':
+            raise ValueError('only gif exports can be optimized')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        job = export_jobs.submit(export_animation, options_data, format, dpi=dpi, optimize=optimize, total=options_data['num_frames'],
+                                 info={'options': options_data, 'format': format, 'dpi': dpi, 'optimize': optimize})
+    except JobQueueFull:
+        return busy('too many exports in progress, try again later', retry_after=30)
+
+    response = jsonify(export_status(job))
+    response.status_code = 202
+    response.headers['Location'] = url_for('export_job', job_id=job.id)
+    return response
+
+def export_status(job):
+    """
+    Returns the JSON status of an export job with the URLs to poll and
+    download it.
+    """
+    status = job.to_dict()
+    status['status_url'] = url_for('export_job', job_id=job.id)
+    if job.status == DONE:
+        status['download_url'] = url_for('download_export', job_id=job.id)
+    return status
+
+@app.route('/exports/<job_id>')
+def export_job(job_id):
+    """
+    Returns the status and progress of an export job.
+    """
+    job = export_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(export_status(job))
+
+@app.route('/exports/<job_id>/download')
+def download_export(job_id):
+    """
+    Returns the file of a finished export job, 409 while it is still running
+    and 410 once the file has been evicted from the cache.
+    """
+    job = export_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if job.status != DONE:
+        return jsonify({'error': f'export is {job.status}'}), 409
+    try:
+        artifact = open(job.result, 'rb')
+    except FileNotFoundError:
+        return jsonify({'error': 'export has expired, submit it again'}), 410
+    format = job.info['format']
+    return send_file(artifact, mimetype=EXPORT_TYPES[format], as_attachment=True, download_name=f'spectrum.{format}')
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Renders the images of many option sets in one request.
+
+    The JSON body holds a list of 'options' dicts, as for /options, and
+    optionally the image 'format'. Identical option sets are rendered once and
+    the rest are rendered in parallel on the render workers. The images are
+    returned as a zip archive of spectrum-<index>.<format> files in the order
+    of the list, or as multipart/mixed parts when the request accepts
+    multipart/mixed rather than application/zip. A set that cannot be
+    rendered fails the whole batch with a 400 naming its index.
+    """
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({'error': 'the body must be a JSON object'}), 400
+    format = body.get('format', 'png')
+    option_sets = body.get('options')
+    if not isinstance(format, str) or format not in IMAGE_TYPES:
+        return jsonify({'error': f'format must be one of {", ".join(IMAGE_TYPES)}, not {format!r}'}), 400
+    if not isinstance(option_sets, list) or not option_sets:
+        return jsonify({'error': 'options must be a non-empty list of option sets'}), 400
+    if len(option_sets) > BATCH_LIMIT:
+        return jsonify({'error': f'at most {BATCH_LIMIT} option sets can be rendered in one batch'}), 400
+    normalized = []
+    for index, options_data in enumerate(option_sets):
+        try:
+            normalized.append(normalize_options(options_data))
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'option set {index}: {e}'}), 400
+
+    # Render every distinct option set once, remembering the first index it appears at
+    first_index = {}
+    for index, options in enumerate(normalized):
+        first_index.setdefault(options_key(options), index)
+    futures = {key: batch_executor.submit(render_batch_item, normalized[index], format) for key, index in first_index.items()}
+    images = {}
+    for key, future in futures.items():
+        try:
+            images[key] = future.result()[0]
+        except Exception as e:
+            for pending in futures.values():
+                pending.cancel()
+            if isinstance(e, RenderPoolFull):
+                return busy()
+            return jsonify({'error': f'option set {first_index[key]}: {e}'}), 400
+    names = [f'spectrum-{index:0{len(str(len(normalized) - 1))}d}.{format}' for index in range(len(normalized))]
+
+    if request.accept_mimetypes['multipart/mixed'] > request.accept_mimetypes['application/zip']:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, options in zip(names, normalized):
+            data = images[options_key(options)]
+            parts.append(f'--{boundary}\r\nContent-Type: {IMAGE_TYPES[format]}\r\nContent-Disposition: attachment; filename="{name}"\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return Response(b''.join(parts), mimetype=f'multipart/mixed; boundary={boundary}')
+
+    archive = io.BytesIO()
+    # Images are already compressed, deflating them again gains nothing
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        for name, options in zip(names, normalized):
+            zf.writestr(name, images[options_key(options)])
+    archive.seek(0)
+    return send_file(archive, mimetype='application/zip', as_attachment=True, download_name='spectra.zip')
+
+@app.route('/stats')
+def stats():
+    return jsonify({'image_cache': image_cache.stats(), 'disk_cache': disk_cache.stats(), 'render_flights': render_flights.stats(), 'figure_pool': figure_pool.stats(), 'render_pool': render_pool.stats() if render_pool is not None else None, 'export_jobs': export_jobs.stats()})
+
+@app.route('/stream')
+def stream():
+    """
+    Streams the live spectrum for the options in the query string as
+    Server-Sent Events.
+
+    The first event, 'grid', is JSON describing the frequency grid and axes.
+    Every following 'frame' event carries the amplitude of each band as
+    base64-encoded little-endian float16 values, in grid order.
+    """
+    try:
+        options_data = normalize_options(request.args.to_dict())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Nothing is drawn per viewer, every stream of these options can share one feed
+    options_data['renderer'] = 'collection'
+
+    feed = get_live_feed(options_data)
+    analyzer = feed.analyzer
+    grid = {
+        'frequencies': analyzer.frequencies.tolist(),
+        'visible_bands': analyzer.visible_bands,
+        'xlim': list(analyzer.ax.get_xlim()),
+        'ylim': list(analyzer.ax.get_ylim()),
+        'fps': feed.fps,
+    }
+
+    def events():
+        yield sse_event('grid', json.dumps(grid))
+        for sequence, frame in feed.subscribe():
+            yield sse_event('frame', base64.b64encode(frame.astype('<f2').tobytes()).decode('ascii'), id=sequence)
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/stream.mjpg')
+def stream_mjpeg():
+    """
+    Streams the live spectrum for the options in the query string as a
+    multipart/x-mixed-replace sequence of JPEG frames, for clients without
+    JavaScript. Each frame is rendered once and sent to every viewer of the
+    same options.
+    """
+    try:
+        options_data = normalize_options(request.args.to_dict())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Share the feed, and its rendered frames, with /stream viewers of the same options
+    options_data['renderer'] = 'collection'
+
+    feed = get_live_feed(options_data)
+
+    def parts():
+        for _, image in feed.subscribe(images=True):
+            yield b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(image)).encode() + b'\r\n\r\n' + image + b'\r\n'
+
+    response = Response(parts(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The reloader runs the app in a child process, only that one serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_render_pool()
+    app.run(debug=True)
@@ -0,0 +1,195 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueueFull(RuntimeError):
+    """
+    Raised when a JobQueue already holds as many unfinished jobs as it accepts.
+    """
+
+
+class ExportJob:
+    """
+    A long-running export submitted to a JobQueue.
+
+    ...
+
+    Attributes
+    ----------
+    id : str
+        identifier of the job
+    info : dict
+        what was submitted, reported back with the status
+    status : str
+        QUEUED, RUNNING, DONE or FAILED
+    done : int
+        number of frames written so far
+    total : int
+        number of frames to write, None until known
+    result : object
+        what the export returned once DONE, e.g. the path of the artifact
+    error : str
+        why the export failed once FAILED
+    submitted : float
+        time.time() the job was submitted at
+    finished : float
+        time.time() the job finished at, None until DONE or FAILED
+
+    Methods
+    -------
+    progress(done, total):
+        Records how far the export has got, called by the export.
+
+    to_dict():
+        Returns the state of the job as a JSON serializable dict.
+    """
+    def __init__(self, total=None, info=None):
+        self.id = uuid.uuid4().hex
+        self.info = info or {}
+        self.status = QUEUED
+        self.done = 0
+        self.total = total
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def progress(self, done, total):
+        """
+        Records that done of total frames have been written.
+        """
+        self.done = done
+        if total is not None:
+            self.total = total
+
+    def to_dict(self):
+        """
+        Returns the state of the job as a JSON serializable dict, without its
+        result.
+        """
+        return {
+            'id': self.id,
+            'info': self.info,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'progress': self.done / self.total if self.total else None,
+            'error': self.error,
+            'submitted': self.submitted,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Runs exports in a few background threads and keeps track of them by id.
+
+    At most max_workers jobs run at once and at most max_queued are unfinished,
+    further submissions are refused with JobQueueFull. Finished jobs are
+    forgotten retention seconds after they finish, on_expire is called with
+    each of them then, e.g. to delete the files they own.
+
+    ...
+
+    Attributes
+    ----------
+    max_workers : int
+        number of jobs run at once
+    max_queued : int
+        number of unfinished jobs accepted
+    retention : float
+        seconds finished jobs are kept for
+    on_expire : callable
+        called with each job as it is forgotten, None to do nothing
+
+    Methods
+    -------
+    submit(function, *args, total=None, info=None, **kwargs):
+        Queues function(*args, progress=job.progress, **kwargs) and returns its job.
+
+    get(job_id):
+        Returns the job with the given id, or None.
+
+    stats():
+        Returns the number of jobs in each status as a dict.
+    """
+    def __init__(self, max_workers=2, max_queued=16, retention=3600, on_expire=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.on_expire = on_expire
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='export')
+
+    def _prune(self):
+        expired = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished is not None and job.finished < expired]:
+            job = self._jobs.pop(job_id)
+            if self.on_expire is not None:
+                self.on_expire(job)
+
+    def submit(self, function, *args, total=None, info=None, **kwargs):
+        """
+        Queues function(*args, progress=job.progress, **kwargs) and returns
+        its ExportJob. Whatever function returns becomes the job's result.
+
+        Raises JobQueueFull when max_queued jobs are unfinished.
+
+        Parameters
+        ----------
+        function : callable
+            the export, called with a progress keyword argument
+        total : int, optional
+            number of frames the export will write
+        info : dict, optional
+            JSON serializable description of the export
+        """
+        job = ExportJob(total, info)
+        with self._lock:
+            self._prune()
+            unfinished = sum(job.finished is None for job in self._jobs.values())
+            if unfinished >= self.max_queued:
+                raise JobQueueFull(f'{unfinished} exports already queued or running')
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def _run(self, job, function, args, kwargs):
+        job.status = RUNNING
+        try:
+            job.result = function(*args, progress=job.progress, **kwargs)
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            status = FAILED
+        else:
+            status = DONE
+        job.finished = time.time()
+        job.status = status
+
+    def get(self, job_id):
+        """
+        Returns the job with the given id, or None when there is no such job
+        or it has expired.
+        """
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """
+        Returns the number of jobs in each status as a dict.
+        """
+        with self._lock:
+            self._prune()
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
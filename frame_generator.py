@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class FrameGenerator:
+    """
+    Generates blocks of random spectrum frames from a seeded NumPy generator.
+
+    ...
+
+    Attributes
+    ----------
+    num_bands : int
+        number of frequency bands in each frame
+    min_amplitude : int
+        minimum amplitude a band can take (inclusive)
+    max_amplitude : int
+        maximum amplitude a band can take (inclusive)
+    block_size : int
+        number of frames generated at once by next_frame()
+    rng : numpy.random.Generator
+        the generator all frames are drawn from
+
+    Methods
+    -------
+    block(num_frames):
+        Returns a (num_frames, num_bands) array of new frames.
+
+    next_frame():
+        Returns the next frame, refilling the internal block when it runs out.
+
+    frames(num_frames):
+        Yields num_frames new frames, generated block_size at a time.
+    """
+    def __init__(self, num_bands, min_amplitude=0, max_amplitude=1000, seed=None, block_size=64):
+        """
+        Constructs the generator and seeds its random number generator.
+
+        A seed of None draws fresh entropy from the OS, any other value gives a
+        reproducible sequence of frames.
+        """
+        if min_amplitude > max_amplitude:
+            raise ValueError(f'min_amplitude ({min_amplitude}) is greater than max_amplitude ({max_amplitude})')
+        self.num_bands = int(num_bands)
+        self.min_amplitude = int(min_amplitude)
+        self.max_amplitude = int(max_amplitude)
+        self.block_size = max(1, int(block_size))
+        self.rng = np.random.default_rng(seed)
+        self._buffer = np.empty((0, self.num_bands), dtype=np.int32)
+        self._position = 0
+
+    def block(self, num_frames):
+        """
+        Returns a block of new frames.
+
+        Parameters
+        ----------
+        num_frames : int
+            number of frames to generate
+
+        Returns
+        -------
+        numpy.ndarray
+            int32 array of shape (num_frames, num_bands) with amplitudes drawn
+            uniformly from [min_amplitude, max_amplitude]
+        """
+        return self.rng.integers(self.min_amplitude, self.max_amplitude, size=(num_frames, self.num_bands), dtype=np.int32, endpoint=True)
+
+    def frames(self, num_frames):
+        """
+        Yields num_frames new frames, generating them block_size at a time so
+        memory does not grow with num_frames. The frames are the same as those
+        of block(num_frames).
+
+        Parameters
+        ----------
+        num_frames : int
+            number of frames to generate
+        """
+        for start in range(0, num_frames, self.block_size):
+            yield from self.block(min(self.block_size, num_frames - start))
+
+    def next_frame(self):
+        """
+        Returns the next frame, generating a new block of block_size frames when
+        the current one has been used up.
+        """
+        if self._position >= len(self._buffer):
+            self._buffer = self.block(self.block_size)
+            self._position = 0
+        frame = self._buffer[self._position]
+        self._position += 1
+        return frame
+
+    def __iter__(self):
+        while True:
+            yield self.next_frame()
@@ -0,0 +1,294 @@
+"""
+Compact binary wire format for streaming spectrum frames.
+
+Every frame is a 28 byte little-endian header followed by a payload:
+
+    offset  size  field
+    0       2     magic, b'SF'
+    2       1     version, 1
+    3       1     flags, a combination of DELTA, FLOAT16 and ZLIB
+    4       4     sequence number of the frame
+    8       4     grid hash, CRC-32 of the frequency grid as float64
+    12      4     number of bands
+    16      4     offset, float32
+    20      4     scale, float32
+    24      4     payload length in bytes
+
+Amplitudes are quantized to 16 bit codes, either uint16 steps of scale above
+offset (amplitude = offset + code * scale) or, with FLOAT16, the bits of the
+float16 amplitude. A keyframe payload is the num_bands codes. With DELTA the
+payload holds only the bands whose code changed since the previous frame:
+
+    4                 number of runs of changed bands
+    8 per run         unchanged bands skipped before the run and length of the run, uint32 each
+    2 per changed band  code difference from the previous frame, modulo 2**16
+
+With ZLIB the payload is deflate-compressed.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'SF'
+VERSION = 1
+
+# Bits of the header flags
+DELTA = 1
+FLOAT16 = 2
+ZLIB = 4
+
+HEADER = struct.Struct('<2sBBIIIffI')
+
+
+class FrameProtocolError(ValueError):
+    """
+    Raised when a frame cannot be decoded.
+    """
+
+
+def grid_hash(frequencies):
+    """
+    Returns the CRC-32 of a frequency grid, used to check that a decoder is
+    reading frames for the grid it expects.
+
+    Parameters
+    ----------
+    frequencies : array of float
+        frequency of each band
+    """
+    return zlib.crc32(np.ascontiguousarray(frequencies, dtype='<f8').tobytes())
+
+
+class FrameEncoder:
+    """
+    Encodes a stream of amplitude frames for one frequency grid.
+
+    A keyframe is sent first, every keyframe_interval frames after that and
+    whenever a delta would be larger. Every other frame is sent as a delta
+    against the previous one.
+
+    ...
+
+    Attributes
+    ----------
+    grid_hash : int
+        CRC-32 of the frequency grid
+    num_bands : int
+        number of bands in each frame
+    quantization : str
+        'uint16' or 'float16'
+    offset : float
+        amplitude of uint16 code 0
+    scale : float
+        amplitude step of one uint16 code
+    keyframe_interval : int
+        maximum number of frames between keyframes
+    compress : bool
+        whether payloads are deflate-compressed
+    sequence : int
+        sequence number of the next frame
+
+    Methods
+    -------
+    encode(amplitudes):
+        Returns the next frame encoded as bytes.
+
+    reset():
+        Makes the next frame a keyframe.
+    """
+    def __init__(self, frequencies, min_amplitude=0, max_amplitude=1000, quantization='uint16', scale=None, keyframe_interval=30, compress=True):
+        """
+        Parameters
+        ----------
+        frequencies : array of float
+            frequency of each band
+        min_amplitude : float
+            lowest amplitude sent with uint16 quantization
+        max_amplitude : float
+            highest amplitude sent with uint16 quantization
+        quantization : str
+            'uint16' for steps of scale above min_amplitude, 'float16' for half
+            precision floats
+        scale : float, optional
+            amplitude step of one uint16 code, defaults to 1 or to whatever
+            fits max_amplitude - min_amplitude in 65535 steps
+        keyframe_interval : int
+            maximum number of frames between keyframes
+        compress : bool
+            whether to deflate-compress payloads
+        """
+        if quantization not in ('uint16', 'float16'):
+            raise ValueError(f"quantization must be 'uint16' or 'float16', not {quantization!r}")
+        self.grid_hash = grid_hash(frequencies)
+        self.num_bands = len(frequencies)
+        self.quantization = quantization
+        if quantization == 'float16':
+            self.offset, self.scale = 0.0, 1.0
+        else:
+            self.offset = float(min_amplitude)
+            self.scale = float(scale) if scale is not None else max(1.0, (max_amplitude - min_amplitude) / 65535)
+        self.keyframe_interval = keyframe_interval
+        self.compress = compress
+        self.sequence = 0
+        self._previous = None
+        self._since_keyframe = 0
+
+    def quantize(self, amplitudes):
+        """
+        Returns the uint16 codes of the given amplitudes.
+        """
+        amplitudes = np.asarray(amplitudes)
+        if self.quantization == 'float16':
+            return amplitudes.astype('<f2').view('<u2')
+        codes = np.rint((amplitudes - self.offset) / self.scale)
+        return np.clip(codes, 0, 65535).astype('<u2')
+
+    def reset(self):
+        """
+        Makes the next frame a keyframe, e.g. for a newly connected client.
+        """
+        self._previous = None
+
+    def encode(self, amplitudes):
+        """
+        Returns the next frame encoded as bytes.
+
+        Parameters
+        ----------
+        amplitudes : array of float
+            the amplitude of each band
+        """
+        if len(amplitudes) != self.num_bands:
+            raise ValueError(f'expected {self.num_bands} amplitudes, got {len(amplitudes)}')
+        codes = self.quantize(amplitudes)
+
+        flags = FLOAT16 if self.quantization == 'float16' else 0
+        payload = codes.tobytes()
+        if self._previous is not None and self._since_keyframe < self.keyframe_interval:
+            delta = _encode_delta(codes - self._previous)
+            if len(delta) < len(payload):
+                payload = delta
+                flags |= DELTA
+        if flags & DELTA:
+            self._since_keyframe += 1
+        else:
+            self._since_keyframe = 0
+
+        if self.compress:
+            payload = zlib.compress(payload, 1)
+            flags |= ZLIB
+
+        header = HEADER.pack(MAGIC, VERSION, flags, self.sequence, self.grid_hash, self.num_bands, self.offset, self.scale, len(payload))
+        self._previous = codes
+        self.sequence += 1
+        return header + payload
+
+
+class FrameDecoder:
+    """
+    Decodes a stream of frames written by a FrameEncoder.
+
+    ...
+
+    Attributes
+    ----------
+    grid_hash : int
+        CRC-32 of the expected frequency grid, None to accept the grid of the
+        first keyframe
+    sequence : int
+        sequence number of the last decoded frame, None before the first one
+
+    Methods
+    -------
+    decode(data):
+        Returns the sequence number and amplitudes of an encoded frame.
+    """
+    def __init__(self, frequencies=None):
+        self.grid_hash = None if frequencies is None else grid_hash(frequencies)
+        self.sequence = None
+        self._previous = None
+
+    def decode(self, data):
+        """
+        Returns the sequence number and amplitudes of an encoded frame.
+
+        Raises FrameProtocolError for malformed frames, frames for another
+        grid and deltas that do not follow the previously decoded frame.
+
+        Parameters
+        ----------
+        data : bytes
+            one frame as returned by FrameEncoder.encode
+
+        Returns
+        -------
+        sequence : int
+            sequence number of the frame
+        amplitudes : numpy.ndarray
+            float32 amplitude of each band
+        """
+        if len(data) < HEADER.size:
+            raise FrameProtocolError('frame is shorter than its header')
+        magic, version, flags, sequence, frame_grid, num_bands, offset, scale, length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise FrameProtocolError(f'not a version {VERSION} spectrum frame')
+        if self.grid_hash is not None and frame_grid != self.grid_hash:
+            raise FrameProtocolError(f'frame is for grid {frame_grid:#010x}, expected {self.grid_hash:#010x}')
+        payload = data[HEADER.size:HEADER.size + length]
+        if len(payload) != length:
+            raise FrameProtocolError('frame payload is truncated')
+        if flags & ZLIB:
+            try:
+                payload = zlib.decompress(payload)
+            except zlib.error as e:
+                raise FrameProtocolError(f'cannot decompress frame payload: {e}')
+
+        if flags & DELTA:
+            if self._previous is None or self.sequence != sequence - 1 or frame_grid != self.grid_hash:
+                raise FrameProtocolError(f'delta frame {sequence} does not follow frame {self.sequence}, a keyframe is needed')
+            codes = _apply_delta(self._previous, payload)
+        else:
+            if len(payload) != 2 * num_bands:
+                raise FrameProtocolError(f'keyframe holds {len(payload) // 2} bands, header says {num_bands}')
+            codes = np.frombuffer(payload, dtype='<u2')
+
+        self.grid_hash = frame_grid
+        self.sequence = sequence
+        self._previous = codes
+        if flags & FLOAT16:
+            return sequence, codes.view('<f2').astype(np.float32)
+        return sequence, (offset + codes * np.float32(scale)).astype(np.float32)
+
+
+def _encode_delta(delta):
+    changed = delta != 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], changed.view(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    runs = np.empty((len(starts), 2), dtype='<u4')
+    runs[:, 0] = starts - np.concatenate(([0], ends[:-1]))
+    runs[:, 1] = ends - starts
+    return struct.pack('<I', len(runs)) + runs.tobytes() + delta[changed].astype('<u2').tobytes()
+
+
+def _apply_delta(previous, payload):
+    try:
+        (num_runs,) = struct.unpack_from('<I', payload)
+        runs = np.frombuffer(payload, dtype='<u4', count=2 * num_runs, offset=4).reshape(-1, 2).astype(np.int64)
+        literals = np.frombuffer(payload, dtype='<u2', offset=4 + 8 * num_runs)
+    except (struct.error, ValueError) as e:
+        raise FrameProtocolError(f'malformed delta payload: {e}')
+    skips, counts = runs[:, 0], runs[:, 1]
+    if counts.sum() != len(literals):
+        raise FrameProtocolError('delta runs do not match the number of changed bands')
+
+    # Run i starts after all earlier skips and runs
+    starts = np.cumsum(skips) + np.concatenate(([0], np.cumsum(counts)[:-1]))
+    if len(starts) and starts[-1] + counts[-1] > len(previous):
+        raise FrameProtocolError('delta runs go past the last band')
+    run_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    indices = np.repeat(starts, counts) + np.arange(len(literals)) - run_offsets
+
+    codes = previous.copy()
+    codes[indices] += literals
+    return codes
@@ -0,0 +1,203 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def build_frequency_grid(min_frequency, max_frequency, num_bands, visible_bands):
+    """
+    Builds the sorted array of band frequencies with the visible bands merged in.
+
+    The grid is num_bands - len(visible_bands) evenly spaced frequencies from
+    min_frequency up to (but not including) max_frequency, with every visible
+    band inserted at its sorted position. The insertion points come from one
+    binary search over the base grid and all bands are merged in a single pass,
+    so building the grid is O(num_bands + k log k) for k visible bands.
+
+    Parameters
+    ----------
+    min_frequency : int
+        minimum frequency of the grid
+    max_frequency : int
+        maximum frequency of the grid
+    num_bands : int
+        total number of bands, including the visible bands
+    visible_bands : list of int
+        frequencies of the visible bands
+
+    Returns
+    -------
+    frequencies : numpy.ndarray
+        the num_bands frequencies of the grid in ascending order
+    visible_indices : dict
+        maps each visible band frequency to its index in frequencies
+    """
+    visible = np.asarray(visible_bands, dtype=float).ravel()
+    num_base = num_bands - len(visible)
+    if num_base < 0:
+        raise ValueError(f'num_bands ({num_bands}) is smaller than the number of visible bands ({len(visible)})')
+
+    base_frequencies = np.linspace(min_frequency, max_frequency, num_base, endpoint=False)
+
+    order = np.argsort(visible, kind='stable')
+    sorted_visible = visible[order]
+    insert_at = np.searchsorted(base_frequencies, sorted_visible, side='left')
+    frequencies = np.insert(base_frequencies, insert_at, sorted_visible)
+
+    # Every visible band before this one also landed in front of it
+    positions = insert_at + np.arange(len(sorted_visible))
+    visible_indices = {}
+    for frequency, position in zip(sorted_visible.tolist(), positions.tolist()):
+        visible_indices.setdefault(frequency, position)
+
+    return frequencies, visible_indices
+
+
+# Total size of the grids shared_frequency_grid keeps, per process
+GRID_CACHE_BYTES = 8 * 2**20
+
+_grid_cache = OrderedDict()
+_grid_cache_bytes = 0
+_grid_cache_lock = threading.Lock()
+
+
+def shared_frequency_grid(min_frequency, max_frequency, num_bands, visible_bands):
+    """
+    Returns the same grid as build_frequency_grid, built once for every caller
+    asking for the same grid while it stays among the most recently used grids
+    totalling GRID_CACHE_BYTES. Grids bigger than that are built every time.
+
+    A cached frequencies array is shared between callers and read-only, the
+    visible_indices dict is always a copy.
+    """
+    global _grid_cache_bytes
+    key = (min_frequency, max_frequency, num_bands, tuple(np.asarray(visible_bands).ravel().tolist()))
+    with _grid_cache_lock:
+        cached = _grid_cache.get(key)
+        if cached is not None:
+            _grid_cache.move_to_end(key)
+            return cached[0], dict(cached[1])
+
+    frequencies, visible_indices = build_frequency_grid(min_frequency, max_frequency, num_bands, visible_bands)
+    if frequencies.nbytes > GRID_CACHE_BYTES:
+        return frequencies, visible_indices
+    frequencies.setflags(write=False)
+    with _grid_cache_lock:
+        if key not in _grid_cache:
+            _grid_cache[key] = (frequencies, visible_indices)
+            _grid_cache_bytes += frequencies.nbytes
+            while _grid_cache_bytes > GRID_CACHE_BYTES:
+                _, (evicted, _) = _grid_cache.popitem(last=False)
+                _grid_cache_bytes -= evicted.nbytes
+    return frequencies, dict(visible_indices)
+
+
+class BandIndex:
+    """
+    Maps frequencies to band indices.
+
+    Every lookup is a binary search on a sorted copy of the frequencies, so
+    looking up a band never scans the whole grid and no structure bigger than
+    that copy is built, however many bands there are.
+
+    ...
+
+    Attributes
+    ----------
+    frequencies : numpy.ndarray
+        frequency of each band, indexed by band
+
+    Methods
+    -------
+    lookup(frequency):
+        Returns the index of the band at frequency, or of the nearest band.
+
+    nearest(frequencies):
+        Returns the index of the nearest band for each frequency.
+
+    in_range(low, high):
+        Returns the indices of all bands with low <= frequency <= high.
+    """
+    def __init__(self, frequencies):
+        """
+        Builds the sorted search array for the given band frequencies.
+
+        Parameters
+        ----------
+        frequencies : array of float
+            frequency of each band, indexed by band
+        """
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self._order = np.argsort(self.frequencies, kind='stable')
+        self._sorted = self.frequencies[self._order]
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def __contains__(self, frequency):
+        return self._exact(frequency) is not None
+
+    def _exact(self, frequency):
+        # The stable sort puts the lowest index of a repeated frequency first
+        position = np.searchsorted(self._sorted, float(frequency), side='left')
+        if position < len(self._sorted) and self._sorted[position] == float(frequency):
+            return int(self._order[position])
+        return None
+
+    def lookup(self, frequency):
+        """
+        Returns the index of the band at the given frequency.
+
+        Falls back to the nearest band when no band sits exactly on frequency.
+
+        Parameters
+        ----------
+        frequency : float
+            the frequency to look up
+        """
+        index = self._exact(frequency)
+        if index is None:
+            index = int(self.nearest(frequency))
+        return index
+
+    def nearest(self, frequencies):
+        """
+        Returns the index of the band nearest to each of the given frequencies.
+
+        Parameters
+        ----------
+        frequencies : float or array of float
+            the frequencies to look up
+
+        Returns
+        -------
+        int or numpy.ndarray
+            band indices, with the same shape as frequencies
+        """
+        if len(self._sorted) == 0:
+            raise ValueError('cannot look up a band in an empty grid')
+        query = np.asarray(frequencies, dtype=float)
+        # The nearest band is either the first one at or above the query or the one before it
+        right = np.clip(np.searchsorted(self._sorted, query), 0, len(self._sorted) - 1)
+        left = np.maximum(right - 1, 0)
+        take_left = np.abs(query - self._sorted[left]) <= np.abs(self._sorted[right] - query)
+        indices = self._order[np.where(take_left, left, right)]
+        if indices.ndim == 0:
+            return int(indices)
+        return indices
+
+    def in_range(self, low, high):
+        """
+        Returns the indices of all bands with low <= frequency <= high, ordered
+        by frequency.
+
+        Parameters
+        ----------
+        low : float
+            lower edge of the range
+        high : float
+            upper edge of the range
+        """
+        start = np.searchsorted(self._sorted, low, side='left')
+        stop = np.searchsorted(self._sorted, high, side='right')
+        return self._order[start:stop]
@@ -0,0 +1,673 @@
+import io
+import multiprocessing
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.colors import to_rgb
+from PIL import Image
+
+from spectrum_render import DRAW_LOCK, new_figure
+
+
+class BarRasterizer:
+    """
+    Draws spectrum frames straight into palettized uint8 images.
+
+    The axes, tick labels and titles are rendered by matplotlib once into a
+    template image. Each frame is a copy of the template with the bars filled
+    in by NumPy, so no figure is drawn per frame.
+
+    ...
+
+    Attributes
+    ----------
+    frequencies : numpy.ndarray
+        center frequency of each bar
+    template : numpy.ndarray
+        uint8 (height, width) palette indices of the empty plot
+    palette : list of int
+        flat RGB palette shared by every frame
+    bar_index : int
+        palette index the bars are drawn with
+    transparent_index : int
+        palette index no frame uses, left free to mark unchanged pixels
+    xlim : (float, float)
+        x axis limits of the plot
+    ylim : (float, float)
+        y axis limits of the plot
+
+    Methods
+    -------
+    frame(amplitudes):
+        Returns a frame as a uint8 array of palette indices.
+
+    image(amplitudes):
+        Returns a frame as a palettized PIL image.
+    """
+    def __init__(self, frequencies, max_amplitude, dpi=80, figsize=None, bar_width=0.8, color='C0', title='Frequency Spectrum', xlabel='Frequency [Hz]', ylabel='Amplitude', colors=254):
+        """
+        Renders the template and works out which pixel columns each bar covers.
+
+        Parameters
+        ----------
+        frequencies : array of float
+            center frequency of each bar
+        max_amplitude : float
+            largest amplitude a frame can hold, the y axis is scaled as
+            matplotlib would scale a frame reaching it
+        dpi : float
+            dots per inch of the rendered frames
+        figsize : (float, float), optional
+            width and height in inches, defaults to rcParams['figure.figsize']
+        bar_width : float
+            width of each bar in Hz, bars narrower than a pixel may not be
+            drawn, as matplotlib would not draw them
+        color : color
+            color of the bars
+        title, xlabel, ylabel : str
+            labels of the plot
+        colors : int
+            number of colors the template is quantized to, at most 254 so the
+            bar and transparent indices fit a 256 color palette. Fewer colors
+            give a smaller palette that GIFs encode with shorter codes.
+        """
+        if not 1 <= colors <= 254:
+            raise ValueError(f'colors must be between 1 and 254, not {colors}')
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        fig, ax = new_figure(figsize=figsize, dpi=dpi)
+
+        # Let matplotlib pick the limits it would use for a full-scale frame,
+        # one bar spanning every band autoscales the same as a bar per band
+        low, high = self.frequencies.min() - bar_width / 2, self.frequencies.max() + bar_width / 2
+        bars = ax.bar([(low + high) / 2], [max_amplitude], width=high - low)
+        self.xlim = ax.get_xlim()
+        self.ylim = ax.get_ylim()
+        bars.remove()
+        ax.set_xlim(self.xlim)
+        ax.set_ylim(self.ylim)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(title)
+
+        with DRAW_LOCK:
+            fig.canvas.draw()
+        rgb = np.asarray(fig.canvas.buffer_rgba())[:, :, :3]
+        height = rgb.shape[0]
+
+        # Quantize the template once, the two entries after its colors are kept
+        # for the bars and for transparency, and the palette is padded to a
+        # power of two as GIF color tables must be
+        template = Image.fromarray(rgb).quantize(colors=colors, dither=Image.Dither.NONE)
+        self.template = np.asarray(template).copy()
+        self.palette = template.getpalette()[:colors * 3]
+        self.palette += [0, 0, 0] * (colors - len(self.palette) // 3)
+        self.bar_index = colors
+        self.palette += [round(c * 255) for c in to_rgb(color)]
+        self.transparent_index = colors + 1
+        self.palette += [0, 0, 0] * ((1 << (colors + 1).bit_length()) - colors - 1)
+
+        # Pixel box strictly inside the spines, rows counted from the top
+        (x0, y0), (x1, y1) = ax.transAxes.transform([(0, 0), (1, 1)])
+        self._left, self._right = int(np.ceil(x0)) + 1, int(np.floor(x1))
+        self._top, self._bottom = height - int(np.floor(y1)) + 1, height - int(np.ceil(y0))
+
+        # Agg snaps the edges of an unstroked rectangle to the nearest pixel
+        # boundary, so a bar covers the columns between its rounded edges and
+        # a bar whose edges round to the same boundary is not drawn at all
+        edges = ax.transData.transform(np.column_stack((np.concatenate((self.frequencies - bar_width / 2, self.frequencies + bar_width / 2)), np.zeros(2 * len(self.frequencies)))))[:, 0]
+        first = np.clip(np.rint(edges[:len(self.frequencies)]).astype(int), self._left, self._right)
+        last = np.clip(np.rint(edges[len(self.frequencies):]).astype(int), self._left, self._right)
+
+        # One entry per (bar, pixel column) pair the bar covers
+        widths = np.maximum(last - first, 0)
+        self._bar_of_column = np.repeat(np.arange(len(self.frequencies)), widths)
+        self._columns = np.repeat(first - self._left, widths) + np.arange(widths.sum()) - np.repeat(np.cumsum(widths) - widths, widths)
+
+        # The y axis is linear, so a bar's top row is a straight function of its amplitude
+        (_, bottom_y), (_, top_y) = ax.transData.transform([(0, self.ylim[0]), (0, self.ylim[1])])
+        self._row_per_amplitude = -(top_y - bottom_y) / (self.ylim[1] - self.ylim[0])
+        self._row_at_zero = height - bottom_y - self._row_per_amplitude * self.ylim[0]
+        self._rows = np.arange(self._top, self._bottom)[:, np.newaxis]
+
+    def frame(self, amplitudes):
+        """
+        Returns a frame as a uint8 array of palette indices.
+
+        Parameters
+        ----------
+        amplitudes : array of float
+            the amplitude of each bar
+        """
+        top_of_bar = np.rint(self._row_at_zero + self._row_per_amplitude * np.asarray(amplitudes, dtype=float)).astype(int)
+        top_of_column = np.full(self._right - self._left, self._bottom)
+        np.minimum.at(top_of_column, self._columns, top_of_bar[self._bar_of_column])
+
+        image = self.template.copy()
+        region = image[self._top:self._bottom, self._left:self._right]
+        region[self._rows >= top_of_column] = self.bar_index
+        return image
+
+    def image(self, amplitudes):
+        """
+        Returns a frame as a palettized PIL image.
+
+        Parameters
+        ----------
+        amplitudes : array of float
+            the amplitude of each bar
+        """
+        image = Image.fromarray(self.frame(amplitudes))
+        image.putpalette(self.palette)
+        return image
+
+
+def encode_frame(pixels, palette):
+    """
+    LZW-encodes a frame and returns its GIF image block.
+
+    The block is the image descriptor and compressed data of the frame, with
+    no header, color table or trailer, ready to be written by a GifWriter
+    using the same palette.
+
+    Parameters
+    ----------
+    pixels : numpy.ndarray
+        uint8 (height, width) palette indices
+    palette : list of int
+        flat RGB palette of 256 colors
+    """
+    image = Image.fromarray(pixels)
+    image.putpalette(palette)
+    buf = io.BytesIO()
+    # Without optimize Pillow keeps the palette indices as they are
+    image.save(buf, format='GIF', optimize=False)
+    return _image_block(buf.getvalue())
+
+
+def encode_difference(previous, pixels, palette, transparency):
+    """
+    LZW-encodes only what changed since the previous frame and returns its GIF
+    image block.
+
+    The block covers the bounding box of the changed pixels, with the pixels
+    inside it that did not change set to the transparent index, so a viewer
+    that keeps the previous frame (disposal method 1) shows pixels identical to
+    pixels. An unchanged frame is a single transparent pixel.
+
+    Parameters
+    ----------
+    previous : numpy.ndarray
+        uint8 (height, width) palette indices of the previous frame
+    pixels : numpy.ndarray
+        uint8 (height, width) palette indices of this frame
+    palette : list of int
+        flat RGB palette
+    transparency : int
+        palette index no frame uses
+    """
+    changed = previous != pixels
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return encode_frame(np.full((1, 1), transparency, dtype=np.uint8), palette)
+    columns = np.flatnonzero(changed.any(axis=0))
+    top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+
+    region = np.where(changed[top:bottom, left:right], pixels[top:bottom, left:right], np.uint8(transparency))
+    block = encode_frame(region, palette)
+    # Move the image descriptor to the corner of the box
+    return block[:1] + struct.pack('<HH', left, top) + block[5:]
+
+
+def _skip_sub_blocks(data, pos):
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _image_block(gif):
+    # Skip the header, logical screen descriptor and global color table
+    pos = 13
+    if gif[10] & 0x80:
+        pos += 3 * (2 << (gif[10] & 7))
+    while gif[pos] == 0x21:
+        pos = _skip_sub_blocks(gif, pos + 2)
+    if gif[pos] != 0x2C:
+        raise ValueError('GIF has no image descriptor')
+    start = pos
+    flags = gif[pos + 9]
+    pos += 10
+    if flags & 0x80:
+        pos += 3 * (2 << (flags & 7))
+    # LZW minimum code size, then the data sub-blocks
+    pos = _skip_sub_blocks(gif, pos + 1)
+    return gif[start:pos]
+
+
+class _AnimationWriter:
+    """
+    Base class of the streaming animation writers.
+
+    Subclasses implement encode, a static method turning a frame into bytes
+    that can run in another process, and write_encoded, which appends those
+    bytes to the file.
+    """
+    def __init__(self, file, seekable=False):
+        self._owns_file = isinstance(file, (str, bytes)) or hasattr(file, '__fspath__')
+        self._file = open(file, 'wb') if self._owns_file else file
+        if seekable and not self._file.seekable():
+            raise ValueError(f'{type(self).__name__} needs a seekable file')
+        self.frames_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_frame(self, pixels):
+        """
+        Encodes and writes a frame.
+
+        Parameters
+        ----------
+        pixels : numpy.ndarray
+            uint8 (height, width) palette indices
+        """
+        self.write_encoded(self.encode(pixels, self.palette))
+
+    def finish(self):
+        pass
+
+    def close(self):
+        """
+        Finishes the file and closes it if the writer opened it.
+        """
+        if self._file is None:
+            return
+        self.finish()
+        if self._owns_file:
+            self._file.close()
+        self._file = None
+
+
+class GifWriter(_AnimationWriter):
+    """
+    Writes a looping GIF one frame at a time.
+
+    Every frame shares one global palette. Frames are written to the file as
+    soon as they are added, so memory use does not depend on the number of
+    frames. With a transparency index every frame is drawn over the previous
+    one, so frames made by encode_difference only hold what changed.
+
+    ...
+
+    Attributes
+    ----------
+    frames_written : int
+        number of frames written so far
+
+    Methods
+    -------
+    add_frame(pixels):
+        Encodes and writes a frame of palette indices.
+
+    write_encoded(block):
+        Writes a frame already encoded by encode.
+
+    close():
+        Writes the trailer and closes the file if the writer opened it.
+    """
+    encode = staticmethod(encode_frame)
+
+    def __init__(self, file, size, palette, fps=20, loop=0, transparency=None):
+        """
+        Writes the GIF header.
+
+        Parameters
+        ----------
+        file : str or file object
+            path or binary file to write to
+        size : (int, int)
+            width and height of every frame in pixels
+        palette : list of int
+            flat RGB palette of up to 256 colors
+        fps : float
+            frames per second of the animation
+        loop : int
+            number of times to loop, 0 loops forever
+        transparency : int, optional
+            palette index drawn as transparent, frames are then kept on screen
+            under the next one instead of being replaced by it
+        """
+        super().__init__(file)
+        self.palette = palette
+        self._delay = round(100 / fps)
+        # Disposal method 1 (leave in place) plus the transparency flag
+        self._control = b'\0\0' if transparency is None else bytes((0x05, transparency))
+
+        width, height = size
+        # Global color table of 2**bits colors, 8 bits per primary
+        bits = max(1, (len(palette) // 3 - 1).bit_length())
+        table = bytes(palette[:3 << bits]).ljust(3 << bits, b'\0')
+        self._file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xF0 | (bits - 1), 0, 0) + table)
+        self._file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\0')
+
+    def write_encoded(self, block):
+        """
+        Writes a frame already encoded by encode with this writer's palette.
+
+        Parameters
+        ----------
+        block : bytes
+            GIF image block of the frame
+        """
+        self._file.write(b'!\xf9\x04' + self._control[:1] + struct.pack('<H', self._delay) + self._control[1:] + b'\0' + block)
+        self.frames_written += 1
+
+    def finish(self):
+        self._file.write(b';')
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+class ApngWriter(_AnimationWriter):
+    """
+    Writes a looping animated PNG one frame at a time.
+
+    Frames are stored as palettized PNG image data and written as soon as they
+    are added. The frame count in the header is filled in on close, so the
+    file must be seekable.
+
+    ...
+
+    Attributes
+    ----------
+    frames_written : int
+        number of frames written so far
+
+    Methods
+    -------
+    add_frame(pixels):
+        Encodes and writes a frame of palette indices.
+
+    write_encoded(data):
+        Writes a frame already encoded by encode.
+
+    close():
+        Fills in the frame count, writes the end chunk and closes the file if
+        the writer opened it.
+    """
+    def __init__(self, file, size, palette, fps=20, loop=0):
+        super().__init__(file, seekable=True)
+        self.palette = palette
+        self.size = size
+        self._sequence = 0
+        self._loop = loop
+        # Delay as a fraction of a second, in milliseconds
+        self._delay = (round(1000 / fps), 1000)
+
+        width, height = size
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 bit palette indices, no interlacing
+        self._file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)))
+        self._file.write(_png_chunk(b'PLTE', bytes(palette[:768]).ljust(768, b'\0')))
+        self._actl_at = self._file.tell()
+        self._file.write(_png_chunk(b'acTL', struct.pack('>II', 0, loop)))
+
+    @staticmethod
+    def encode(pixels, palette):
+        """
+        Returns the zlib-compressed PNG image data of a frame, each row
+        prefixed with filter type 0.
+        """
+        rows = np.zeros((pixels.shape[0], pixels.shape[1] + 1), dtype=np.uint8)
+        rows[:, 1:] = pixels
+        return zlib.compress(rows.tobytes(), 6)
+
+    def write_encoded(self, data):
+        """
+        Writes a frame already encoded by encode.
+
+        Parameters
+        ----------
+        data : bytes
+            compressed PNG image data of the frame
+        """
+        width, height = self.size
+        self._file.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self._sequence, width, height, 0, 0, *self._delay, 0, 0)))
+        self._sequence += 1
+        if self.frames_written == 0:
+            self._file.write(_png_chunk(b'IDAT', data))
+        else:
+            self._file.write(_png_chunk(b'fdAT', struct.pack('>I', self._sequence) + data))
+            self._sequence += 1
+        self.frames_written += 1
+
+    def finish(self):
+        self._file.write(_png_chunk(b'IEND', b''))
+        end = self._file.tell()
+        self._file.seek(self._actl_at)
+        self._file.write(_png_chunk(b'acTL', struct.pack('>II', self.frames_written, self._loop)))
+        self._file.seek(end)
+
+
+def _riff_chunk(kind, data):
+    return kind + struct.pack('<I', len(data)) + data + (b'\0' if len(data) % 2 else b'')
+
+
+class WebPWriter(_AnimationWriter):
+    """
+    Writes a looping animated WebP one frame at a time.
+
+    Each frame is compressed losslessly on its own and wrapped in an animation
+    frame chunk as soon as it is added. The RIFF size is filled in on close,
+    so the file must be seekable.
+
+    ...
+
+    Attributes
+    ----------
+    frames_written : int
+        number of frames written so far
+
+    Methods
+    -------
+    add_frame(pixels):
+        Encodes and writes a frame of palette indices.
+
+    write_encoded(data):
+        Writes a frame already encoded by encode.
+
+    close():
+        Fills in the file size and closes the file if the writer opened it.
+    """
+    def __init__(self, file, size, palette, fps=20, loop=0):
+        super().__init__(file, seekable=True)
+        self.palette = palette
+        self.size = size
+        self._duration = round(1000 / fps)
+        self._start = self._file.tell()
+
+        width, height = size
+        self._file.write(b'RIFF\0\0\0\0WEBP')
+        # Animation flag, canvas size minus one in 24 bits each
+        self._file.write(_riff_chunk(b'VP8X', struct.pack('<I', 0x02) + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little')))
+        self._file.write(_riff_chunk(b'ANIM', struct.pack('<IH', 0xFFFFFFFF, loop)))
+
+    @staticmethod
+    def encode(pixels, palette):
+        """
+        Returns the image chunks of a frame compressed as a lossless WebP.
+        """
+        image = Image.fromarray(pixels)
+        image.putpalette(palette)
+        buf = io.BytesIO()
+        image.convert('RGB').save(buf, format='WEBP', lossless=True, quality=50, method=0)
+        data = buf.getvalue()
+
+        # Keep the bitstream chunks of the still image, drop its RIFF header
+        chunks = []
+        pos = 12
+        while pos < len(data):
+            kind, length = data[pos:pos + 4], struct.unpack_from('<I', data, pos + 4)[0]
+            end = pos + 8 + length + (length % 2)
+            if kind in (b'ALPH', b'VP8 ', b'VP8L'):
+                chunks.append(data[pos:end])
+            pos = end
+        return b''.join(chunks)
+
+    def write_encoded(self, data):
+        """
+        Writes a frame already encoded by encode.
+
+        Parameters
+        ----------
+        data : bytes
+            WebP image chunks of the frame
+        """
+        width, height = self.size
+        header = (0).to_bytes(6, 'little') + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little') + self._duration.to_bytes(3, 'little') + b'\x02'
+        self._file.write(_riff_chunk(b'ANMF', header + data))
+        self.frames_written += 1
+
+    def finish(self):
+        end = self._file.tell()
+        self._file.seek(self._start + 4)
+        self._file.write(struct.pack('<I', end - self._start - 8))
+        self._file.seek(end)
+
+
+WRITERS = {'gif': GifWriter, 'png': ApngWriter, 'apng': ApngWriter, 'webp': WebPWriter}
+
+
+def _encode_frames(rasterizer, encode, frames, previous=None, optimize=False):
+    """
+    Yields each frame rasterized and encoded, as differences from the frame
+    before it when optimizing. previous is the amplitudes of the frame before
+    the first one, if any.
+    """
+    if optimize and previous is not None:
+        previous = rasterizer.frame(previous)
+    else:
+        previous = None
+    for amplitudes in frames:
+        pixels = rasterizer.frame(amplitudes)
+        if previous is None:
+            yield encode(pixels, rasterizer.palette)
+        else:
+            yield encode_difference(previous, pixels, rasterizer.palette, rasterizer.transparent_index)
+        if optimize:
+            previous = pixels
+
+
+_worker_encoder = None
+
+
+def _init_worker(rasterizer, encode, optimize):
+    global _worker_encoder
+    _worker_encoder = (rasterizer, encode, optimize)
+
+
+def _encode_chunk(previous, frames):
+    rasterizer, encode, optimize = _worker_encoder
+    return list(_encode_frames(rasterizer, encode, frames, previous, optimize))
+
+
+def _chunks(frames, size):
+    chunk = []
+    for amplitudes in frames:
+        chunk.append(amplitudes)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def save_animation(file_name, frames, rasterizer, fps=20, format=None, workers=None, progress=None, total=None, optimize=False):
+    """
+    Rasterizes frames and streams them into a looping GIF, APNG or animated WebP.
+
+    Frames are pulled from the iterable and written one at a time, so memory
+    use stays constant however many frames there are.
+
+    With workers the frames are grouped into chunks that a pool of processes
+    rasterizes and encodes, each with its own copy of the rasterizer. Only a
+    couple of chunks per worker are in flight at once and the results are
+    written in frame order, so the file is the same whatever the number of
+    workers.
+
+    An optimized GIF stores each frame after the first as only the box of
+    pixels that changed since the frame before, with unchanged pixels inside
+    it transparent. Pair it with a rasterizer built with few colors for the
+    smallest files.
+
+    Parameters
+    ----------
+    file_name : str
+        path of the file to write
+    frames : iterable of array of float
+        amplitudes of each frame
+    rasterizer : BarRasterizer
+        draws each frame
+    fps : float
+        frames per second of the animation
+    format : str, optional
+        'gif', 'apng' or 'webp', defaults to the extension of file_name
+        ('.png' writes an APNG)
+    workers : int, optional
+        number of processes to encode with, None or 1 encodes in this process
+    progress : callable, optional
+        called as progress(frames_written, total) after every frame
+    total : int, optional
+        number of frames, only passed on to progress
+    optimize : bool
+        encode GIF frames as differences from the previous frame
+    """
+    if format is None:
+        format = os.path.splitext(file_name)[1].lstrip('.').lower()
+    try:
+        writer_class = WRITERS[format]
+    except KeyError:
+        raise ValueError(f'cannot write animations as {format!r}, use one of {", ".join(WRITERS)}')
+    options = {}
+    if optimize:
+        if writer_class is not GifWriter:
+            raise ValueError(f'only GIFs can be optimized, not {format!r}')
+        options['transparency'] = rasterizer.transparent_index
+
+    height, width = rasterizer.template.shape
+    with writer_class(file_name, (width, height), rasterizer.palette, fps=fps, **options) as writer:
+        def write(data):
+            writer.write_encoded(data)
+            if progress is not None:
+                progress(writer.frames_written, total)
+
+        if not workers or workers <= 1:
+            for data in _encode_frames(rasterizer, writer.encode, frames, optimize=optimize):
+                write(data)
+            return
+
+        chunk_size = 8
+        pending = deque()
+        previous = None
+        # Spawned rather than forked, exports also run from threads of the web server
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(rasterizer, writer_class.encode, optimize)) as executor:
+            for chunk in _chunks(frames, chunk_size):
+                # Each chunk takes the last frame of the one before so its first difference can be worked out
+                pending.append(executor.submit(_encode_chunk, previous, chunk))
+                previous = chunk[-1]
+                # Bound the chunks in flight so memory does not grow with the frame count
+                while len(pending) >= 2 * workers:
+                    for data in pending.popleft().result():
+                        write(data)
+            while pending:
+                for data in pending.popleft().result():
+                    write(data)
@@ -0,0 +1,11 @@
+# Settings for serving app.py with gunicorn, e.g. `gunicorn app:app`
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = 8
+
+
+def post_fork(server, worker):
+    # Spawn and warm each worker's render processes before it takes requests
+    import app
+    app.start_render_pool()
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+
+from spectrum_render import render_image
+
+logger = logging.getLogger(__name__)
+
+
+class LiveSpectrum:
+    """
+    Runs one spectrum simulation in a background thread and shares every frame
+    with all of its subscribers.
+
+    The thread starts with the first subscriber and stops after the last one
+    leaves. Subscribers always get the most recent frame, one that falls behind
+    skips frames instead of queueing them, so the cost of the simulation does
+    not grow with the number of viewers. While anyone subscribes to images,
+    each frame is also drawn on the analyzer's figure and encoded once, and
+    that one image goes to every image subscriber.
+
+    ...
+
+    Attributes
+    ----------
+    analyzer : SpectrumAnalyzer
+        the analyzer whose frame generator produces the frames
+    fps : float
+        frames produced per second
+    sequence : int
+        number of the latest frame, 0 before the first one
+    frame : numpy.ndarray
+        amplitudes of the latest frame
+    image : bytes
+        the latest frame encoded as image_format, None while nobody subscribes
+        to images
+    image_format : str
+        format the frames are encoded in for image subscribers
+
+    Methods
+    -------
+    subscribe(timeout=5, images=False):
+        Yields (sequence, frame) or (sequence, image) pairs as frames are produced.
+
+    idle:
+        Whether the feed has no subscribers.
+
+    idle_for:
+        Seconds since the feed last had subscribers.
+    """
+    def __init__(self, analyzer, fps=30, image_format='jpeg'):
+        self.analyzer = analyzer
+        self.fps = fps
+        self.image_format = image_format
+        self.sequence = 0
+        self.frame = None
+        self.image = None
+        self._subscribers = 0
+        self._image_subscribers = 0
+        self._thread = None
+        self._condition = threading.Condition()
+        self._idle_since = time.monotonic()
+
+    @property
+    def idle(self):
+        with self._condition:
+            return self._subscribers == 0 and self._thread is None
+
+    @property
+    def idle_for(self):
+        """
+        Seconds since the feed was created or its thread stopped, 0 while it
+        has subscribers.
+        """
+        with self._condition:
+            if self._subscribers or self._thread is not None:
+                return 0
+            return time.monotonic() - self._idle_since
+
+    def next_frame(self):
+        """
+        Produces the next frame, called from the simulation thread.
+        """
+        return self.analyzer.frame_generator.next_frame()
+
+    def render(self, frame):
+        """
+        Draws frame on the analyzer's figure and returns it encoded as
+        image_format, called from the simulation thread.
+        """
+        self.analyzer.set_bar_heights(frame)
+        return render_image(self.analyzer.fig, format=self.image_format)
+
+    def publish(self, frame):
+        """
+        Makes frame the latest frame and wakes every subscriber, rendering it
+        first if anyone subscribes to images.
+
+        Parameters
+        ----------
+        frame : numpy.ndarray
+            amplitudes of the new frame
+        """
+        with self._condition:
+            render = self._image_subscribers > 0
+        image = self.render(frame) if render else None
+        with self._condition:
+            self.frame = frame
+            self.image = image
+            self.sequence += 1
+            self._condition.notify_all()
+
+    def _run(self):
+        interval = 1 / self.fps
+        deadline = time.monotonic()
+        try:
+            while True:
+                with self._condition:
+                    if self._subscribers == 0:
+                        self._thread = None
+                        self._idle_since = time.monotonic()
+                        return
+                self.publish(self.next_frame())
+                deadline += interval
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Fell behind, don't try to catch up with a burst of frames
+                    deadline = time.monotonic()
+        except Exception:
+            logger.exception('live spectrum feed stopped')
+            # Lets the feed go idle and ends its subscriptions instead of leaving them waiting
+            with self._condition:
+                self._thread = None
+                self._idle_since = time.monotonic()
+                self._condition.notify_all()
+
+    def subscribe(self, timeout=5, images=False):
+        """
+        Yields (sequence, frame) pairs as frames are produced, starting with
+        the next one. The subscription ends when the generator is closed.
+
+        Parameters
+        ----------
+        timeout : float
+            seconds to wait for a frame before giving up
+        images : bool
+            yield (sequence, image) pairs with each frame rendered as
+            image_format instead
+        """
+        with self._condition:
+            self._subscribers += 1
+            self._image_subscribers += images
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-spectrum', daemon=True)
+                self._thread.start()
+            seen = self.sequence
+        try:
+            while True:
+                with self._condition:
+                    # Frames published before the first image subscriber arrived have no image
+                    if not self._condition.wait_for(lambda: self._thread is None or (self.sequence > seen and (not images or self.image is not None)), timeout):
+                        return
+                    if self._thread is None:
+                        return
+                    seen, frame = self.sequence, self.image if images else self.frame
+                yield seen, frame
+        finally:
+            with self._condition:
+                self._subscribers -= 1
+                self._image_subscribers -= images
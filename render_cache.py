@@ -0,0 +1,396 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded cache that evicts the least recently used entry.
+
+    ...
+
+    Attributes
+    ----------
+    maxsize : int
+        maximum number of entries kept
+    hits : int
+        number of lookups that found an entry
+    misses : int
+        number of lookups that did not
+    evictions : int
+        number of entries dropped to make room
+
+    Methods
+    -------
+    get(key, default=None):
+        Returns the entry for key and marks it as recently used.
+
+    put(key, value):
+        Stores value under key, evicting the oldest entry when full.
+
+    stats():
+        Returns the size and counters of the cache as a dict.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Returns the entry for key and marks it as recently used.
+
+        Parameters
+        ----------
+        key : hashable
+            the key to look up
+        default : object
+            returned when there is no entry for key
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entries when
+        the cache is full.
+
+        Parameters
+        ----------
+        key : hashable
+            the key to store under
+        value : object
+            the value to store
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns the size and counters of the cache as a dict.
+        """
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class DiskCache:
+    """
+    A size-bounded cache of bytes on disk that any number of processes can
+    share.
+
+    Entries are content addressed: a key is stored in a file named after the
+    SHA-256 of its JSON form, so every process finds an entry another one
+    wrote. Writes go to a temporary file that is renamed into place, so a
+    reader sees a whole entry or none and reads need no lock. Reading an entry
+    bumps its modification time, and once the directory grows past max_bytes
+    the least recently used entries are deleted.
+
+    ...
+
+    Attributes
+    ----------
+    directory : str
+        directory the entries are stored in
+    max_bytes : int
+        size the entries are trimmed back to
+    hits : int
+        number of lookups by this process that found an entry
+    misses : int
+        number of lookups by this process that did not
+    writes : int
+        number of entries written by this process
+    evictions : int
+        number of entries deleted by this process to make room
+
+    Methods
+    -------
+    get(key):
+        Returns the bytes stored under key, or None.
+
+    put(key, data):
+        Stores data under key.
+
+    path(key):
+        Returns the path of the file stored under key, or None.
+
+    put_file(key, source):
+        Moves the file at source into the cache under key.
+
+    stats():
+        Returns the size and counters of the cache as a dict.
+    """
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # Bytes written since the directory was last measured, other
+        # processes' writes are only seen when it is measured again
+        self._unmeasured = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _file_name(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def path(self, key):
+        """
+        Returns the path of the file stored under key, or None when there is no
+        such entry. The file stays readable through an open handle even if it
+        is evicted.
+
+        Parameters
+        ----------
+        key : JSON serializable
+            the key to look up
+        """
+        file_name = self._file_name(key)
+        try:
+            os.utime(file_name)
+        except FileNotFoundError:
+            file_name = None
+        with self._lock:
+            if file_name is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return file_name
+
+    def get(self, key):
+        """
+        Returns the bytes stored under key, or None when there is no such entry.
+
+        Parameters
+        ----------
+        key : JSON serializable
+            the key to look up
+        """
+        file_name = self.path(key)
+        if file_name is None:
+            return None
+        try:
+            with open(file_name, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+
+    def put(self, key, data):
+        """
+        Stores data under key, replacing any entry already there.
+
+        Parameters
+        ----------
+        key : JSON serializable
+            the key to store under
+        data : bytes
+            the value to store
+        """
+        fd, temp_name = self._temp_file(key)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+        self._publish(key, temp_name, len(data))
+
+    def put_file(self, key, source):
+        """
+        Moves the file at source into the cache under key and returns its new
+        path. source is copied when it is on another file system.
+
+        Parameters
+        ----------
+        key : JSON serializable
+            the key to store under
+        source : str
+            path of the file to move
+        """
+        fd, temp_name = self._temp_file(key)
+        os.close(fd)
+        try:
+            try:
+                os.replace(source, temp_name)
+            except OSError:
+                shutil.copyfile(source, temp_name)
+                os.remove(source)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+        return self._publish(key, temp_name, os.path.getsize(temp_name))
+
+    def _temp_file(self, key):
+        directory = os.path.dirname(self._file_name(key))
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.mkstemp(dir=directory, prefix='.tmp-')
+
+    def _publish(self, key, temp_name, size):
+        file_name = self._file_name(key)
+        os.replace(temp_name, file_name)
+        with self._lock:
+            self.writes += 1
+            self._unmeasured += size
+            evict = self._unmeasured > self.max_bytes // 10
+            if evict:
+                self._unmeasured = 0
+        if evict:
+            self._evict()
+        return file_name
+
+    def _entries(self):
+        for directory in os.scandir(self.directory):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, entry.name, stat
+
+    def _evict(self):
+        entries = []
+        stale = time.time() - 3600
+        for path, name, stat in self._entries():
+            if not name.startswith('.tmp-'):
+                entries.append((stat.st_mtime, stat.st_size, path))
+            elif stat.st_mtime < stale:
+                # Left behind by a writer that died mid-write
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        total = sum(size for _, size, _ in entries)
+        # Oldest first, trimmed to 90% so every write does not trigger a scan
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self.evictions += 1
+            total -= size
+
+    def stats(self):
+        """
+        Returns the size of the cache and the counters of this process as a
+        dict.
+        """
+        sizes = [stat.st_size for _, name, stat in self._entries() if not name.startswith('.tmp-')]
+        return {'entries': len(sizes), 'bytes': sum(sizes), 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'evictions': self.evictions}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one.
+
+    The first caller for a key runs the function, callers that arrive while it
+    runs wait for it and get its result, or its exception, instead of running
+    the function again. Once the call returns the key is forgotten, so later
+    callers run it anew.
+
+    ...
+
+    Attributes
+    ----------
+    calls : int
+        number of calls made through do()
+    executions : int
+        number of calls that ran the function
+    coalesced : int
+        number of calls that shared another call's result instead
+
+    Methods
+    -------
+    do(key, function, *args, **kwargs):
+        Returns function(*args, **kwargs), sharing a run already in flight for key.
+
+    stats():
+        Returns the counters as a dict.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Returns function(*args, **kwargs), or waits for and returns the result
+        of the call already running for key.
+
+        Parameters
+        ----------
+        key : hashable
+            identifies calls that give the same result
+        function : callable
+            called with args and kwargs when no call for key is in flight
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stats(self):
+        """
+        Returns the counters and the number of calls in flight as a dict.
+        """
+        with self._lock:
+            return {'calls': self.calls, 'executions': self.executions, 'coalesced': self.coalesced, 'in_flight': len(self._in_flight)}
@@ -0,0 +1,179 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from spectrum_analyzer import SpectrumAnalyzer
+from spectrum_render import FigurePool, render_image
+
+# Set in each worker process by _init_worker
+_figure_pool = None
+
+
+class RenderPoolFull(RuntimeError):
+    """
+    Raised when a RenderPool already has as many renders queued as it accepts.
+    """
+
+
+def _init_worker(figures):
+    global _figure_pool
+    _figure_pool = FigurePool(max_idle=figures)
+    _figure_pool.prewarm(figures)
+
+
+def _warm_up():
+    # Draws one plot so fonts and the text cache are loaded before the first request
+    _render({}, 'png')
+
+
+def _render(options, format):
+    analyzer = SpectrumAnalyzer(**options, figure_pool=_figure_pool)
+    try:
+        return render_image(analyzer.fig, format=format)
+    finally:
+        analyzer.release_figure()
+
+
+class RenderPool:
+    """
+    Renders SpectrumAnalyzer images in a pool of warm worker processes.
+
+    Every worker imports matplotlib, builds a few figures and draws one plot
+    when the pool starts, so the first requests do not pay for it. Renders run
+    on all cores without sharing matplotlib between threads. At most
+    max_pending renders are queued or running, further requests are refused
+    with RenderPoolFull so callers can shed load instead of piling up.
+
+    ...
+
+    Attributes
+    ----------
+    processes : int
+        number of worker processes
+    max_pending : int
+        number of renders accepted at once
+    completed : int
+        number of renders finished, successfully or not
+    rejected : int
+        number of renders refused because the pool was full
+
+    Methods
+    -------
+    submit(options, format='png'):
+        Queues a render and returns a Future of its image bytes.
+
+    render(options, format='png', timeout=None):
+        Renders an image and waits for its bytes.
+
+    shutdown():
+        Stops the worker processes.
+
+    stats():
+        Returns the size and counters of the pool as a dict.
+    """
+    def __init__(self, processes=None, max_pending=32, figures=2):
+        """
+        Starts the worker processes and warms them up.
+
+        Parameters
+        ----------
+        processes : int, optional
+            number of worker processes, defaults to the number of CPUs
+        max_pending : int
+            number of renders accepted at once
+        figures : int
+            figures each worker builds in advance and keeps for reuse
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_pending = max_pending
+        self.figures = figures
+        self.rejected = 0
+        self.completed = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._start()
+
+    def _start(self):
+        # Spawned rather than forked, forking a process running server threads is unsafe
+        self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker, initargs=(self.figures,))
+        # One task per worker makes the executor start every process now
+        for _ in range(self.processes):
+            self._executor.submit(_warm_up)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    def submit(self, options, format='png'):
+        """
+        Queues a render and returns a concurrent.futures.Future of its image
+        bytes.
+
+        Raises RenderPoolFull when max_pending renders are already queued or
+        running.
+
+        Parameters
+        ----------
+        options : dict
+            keyword arguments of the SpectrumAnalyzer
+        format : str
+            image format to encode the plot in
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise RenderPoolFull(f'{self._pending} renders already pending')
+            self._pending += 1
+            executor = self._executor
+        try:
+            try:
+                future = executor.submit(_render, options, format)
+            except BrokenProcessPool:
+                # A worker died, start a new set of workers and try once more
+                with self._lock:
+                    if self._executor is executor:
+                        self._start()
+                    executor = self._executor
+                future = executor.submit(_render, options, format)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def render(self, options, format='png', timeout=None):
+        """
+        Renders an image in a worker and returns its bytes.
+
+        Raises RenderPoolFull when the pool is full and
+        concurrent.futures.TimeoutError when the render takes longer than
+        timeout seconds.
+
+        Parameters
+        ----------
+        options : dict
+            keyword arguments of the SpectrumAnalyzer
+        format : str
+            image format to encode the plot in
+        timeout : float, optional
+            seconds to wait for the render
+        """
+        return self.submit(options, format).result(timeout)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker processes, waiting for queued renders when wait is
+        true.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def stats(self):
+        """
+        Returns the size and counters of the pool as a dict.
+        """
+        with self._lock:
+            return {'processes': self.processes, 'pending': self._pending, 'max_pending': self.max_pending, 'completed': self.completed, 'rejected': self.rejected}
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+class Wiggle:
+    """
+    Adds a sine-shaped wobble to a random subset of bands to give the plot a noisy feel.
+
+    ...
+
+    Attributes
+    ----------
+    fraction : float
+        fraction of the bands that wiggle on each frame
+    period : float
+        period of the sine wave in frames
+    amplitude : float
+        peak offset added to a wiggling band
+    rng : numpy.random.Generator
+        the generator the wiggling bands are drawn from
+
+    Methods
+    -------
+    mask(num_bands):
+        Returns a boolean mask selecting the bands that wiggle this frame.
+
+    apply(amplitudes, frame):
+        Returns the bar heights for the given amplitudes with the wiggle applied.
+    """
+    def __init__(self, fraction=0.1, period=100, amplitude=10, seed=None):
+        self.fraction = fraction
+        self.period = period
+        self.amplitude = amplitude
+        self.rng = np.random.default_rng(seed)
+
+    def mask(self, num_bands):
+        """
+        Returns a boolean mask selecting int(num_bands * fraction) random bands.
+
+        Parameters
+        ----------
+        num_bands : int
+            number of bands in the frame
+        """
+        mask = np.zeros(num_bands, dtype=bool)
+        mask[self.rng.choice(num_bands, int(num_bands * self.fraction), replace=False)] = True
+        return mask
+
+    def offset(self, frame):
+        """
+        Returns the offset added to wiggling bands on the given frame.
+
+        Parameters
+        ----------
+        frame : int
+            the current frame of the animation
+        """
+        return self.amplitude * np.sin(frame / self.period * 2 * np.pi)
+
+    def apply(self, amplitudes, frame, out=None):
+        """
+        Returns the bar heights with the wiggle applied, truncated to whole
+        numbers and clipped at zero.
+
+        Parameters
+        ----------
+        amplitudes : array of float
+            the amplitude of each band
+        frame : int
+            the current frame of the animation
+        out : numpy.ndarray, optional
+            array to write the heights into
+        """
+        amplitudes = np.asarray(amplitudes)
+        heights = np.add(amplitudes, np.trunc(self.offset(frame)) * self.mask(len(amplitudes)), out=out, dtype=float)
+        np.trunc(heights, out=heights)
+        return np.maximum(heights, 0, out=heights)
+
+
+DEFAULT_SHAPING_KERNEL = (0.9, 0.95, 0.9, 0.8, 0.6)
+
+
+def shape_bands(amplitudes, sources, kernel=DEFAULT_SHAPING_KERNEL, noise_floor=0, out=None):
+    """
+    Shapes the skirt of bands around every transmitting band at once.
+
+    kernel[k] is the fraction of a transmitter's amplitude that spills into the
+    bands k places either side of it (kernel[0], the transmitter itself, is not
+    used). Each band within reach of a transmitter takes the strongest spill it
+    receives, but never drops below the noise floor. The transmitters keep their
+    own amplitude and bands out of reach of every transmitter are left alone.
+
+    The spill is a max-convolution of the transmitter amplitudes with the
+    kernel, taken one kernel tap at a time over shifted slices of the whole
+    array, so the cost does not depend on how many transmitters there are. It
+    is computed in the dtype of amplitudes (float64 for integer amplitudes)
+    into a few preallocated arrays of num_bands values.
+
+    Parameters
+    ----------
+    amplitudes : array of float
+        the amplitude of each band
+    sources : array of int or array of bool
+        indices of the transmitting bands, or a mask selecting them
+    kernel : sequence of float
+        spill fraction by distance from the transmitter
+    noise_floor : float
+        lowest amplitude a shaped band can take
+    out : numpy.ndarray, optional
+        array to write the result into, may be amplitudes itself
+
+    Returns
+    -------
+    numpy.ndarray
+        the shaped amplitudes
+    """
+    amplitudes = np.asarray(amplitudes)
+    dtype = amplitudes.dtype if np.issubdtype(amplitudes.dtype, np.floating) else np.float64
+    if out is None:
+        out = amplitudes.astype(dtype)
+    elif out is not amplitudes:
+        out[:] = amplitudes
+
+    num_bands = len(amplitudes)
+    active = np.zeros(num_bands, dtype=bool)
+    active[sources] = True
+    if len(kernel) <= 1 or not active.any():
+        return out
+
+    levels = np.zeros(num_bands, dtype=dtype)
+    np.copyto(levels, amplitudes, where=active, casting='unsafe')
+    spill = np.zeros(num_bands, dtype=dtype)
+    scratch = np.empty(num_bands, dtype=dtype)
+    in_reach = np.zeros(num_bands, dtype=bool)
+    for distance, fraction in enumerate(kernel[1:num_bands], start=1):
+        rest = num_bands - distance
+        # Spill into the bands distance places above, then below, every transmitter
+        np.multiply(levels[:rest], fraction, out=scratch[:rest], casting='unsafe')
+        np.maximum(spill[distance:], scratch[:rest], out=spill[distance:])
+        np.multiply(levels[distance:], fraction, out=scratch[:rest], casting='unsafe')
+        np.maximum(spill[:rest], scratch[:rest], out=spill[:rest])
+        in_reach[distance:] |= active[:rest]
+        in_reach[:rest] |= active[distance:]
+
+    # Transmitters keep their own amplitude
+    in_reach &= ~active
+    np.maximum(spill, noise_floor, out=spill, casting='unsafe')
+    np.copyto(out, spill, where=in_reach, casting='unsafe')
+    return out
@@ -1,11 +1,12 @@
-import tkinter as tk
-import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import numpy as np
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import random
 from matplotlib.animation import PillowWriter, FuncAnimation
-import matplotlib.animation as animation
+from frame_generator import FrameGenerator
+from spectrum_render import DRAW_LOCK, BarCollection, FrameRateMeter, new_figure, threshold_colors
+from frequency_grid import BandIndex, shared_frequency_grid
+from spectral_effects import DEFAULT_SHAPING_KERNEL, Wiggle, shape_bands
+from analyzer_state import ALERT, EMITTER, VISIBLE, AnalyzerState
+from gif_export import BarRasterizer, save_animation
 #import tkinter.ttk as ttk
 
 class SpectrumAnalyzer:
@@ -30,8 +31,30 @@ class SpectrumAnalyzer:
         list of frequencies for the visible bands
     noise_floor : list of int
         amplitude of the noise floor
-    amplitudes : list of int
-        amplitudes of each band to be plotted
+    amplitudes : numpy.ndarray
+        float32 amplitudes of each band to be plotted, a view of state.amplitudes
+    state : AnalyzerState
+        preallocated per-band amplitudes, thresholds, colors and flags
+    visible_band_indices : dict
+        maps each visible band frequency to its index in frequencies
+    band_index : BandIndex
+        maps any frequency to the index of its band
+    frame_generator : FrameGenerator
+        seeded source of random frames used by update_bars and save_spectrum_gif
+    seed : int
+        seed of frame_generator, None for fresh entropy
+    renderer : str
+        'bars' draws one Rectangle per band, 'collection' draws all bands as a
+        single BarCollection
+    wiggle_effect : Wiggle
+        the wiggle applied to the bars each frame, its fraction, period and
+        amplitude can be changed at any time
+    shaping_kernel : sequence of float
+        fraction of a transmitter's amplitude that spills into the bands next to it
+    frame_rate : FrameRateMeter
+        measures the frame rate the animation actually achieves
+    figure_pool : FigurePool
+        pool create_bar_plot takes its figure from, None to build a new one
 
     Methods
     -------
@@ -41,15 +64,39 @@ class SpectrumAnalyzer:
     create_options_window():
         Creates the options window.
 
+    build_bands():
+        Sizes the band state, frame generator and frequency grid for the current options.
+
     create_bar_plot_frame():
         Creates the frame for the spectrum analyzer plot.
 
     create_control_frame():
         Creates the frame for the control buttons and sliders.
 
+    release_figure():
+        Returns the plot's figure to the figure pool.
+
     set_amplitude(amplitude):
         Sets the amplitude of the currently selected band.
 
+    set_emitter(frequency, transmitting=True):
+        Marks the band at frequency as transmitting alongside the selected band.
+
+    set_threshold(frequency, threshold):
+        Sets the amplitude at which the band at frequency turns green.
+
+    update_colors():
+        Recolors every band by whether it has reached its threshold.
+
+    draw_bars():
+        Draws one bar per band using the configured renderer.
+
+    set_bar_heights(heights):
+        Sets the height of every bar in the plot.
+
+    animated_artists():
+        Returns the artists that change from frame to frame.
+
     wiggle(frame):
         Creates a wiggle effect to give a noisy feel to the plot.
 
@@ -59,10 +106,13 @@ class SpectrumAnalyzer:
     update_label():
         Updates the label displaying the selected band and its amplitude.
 
-    create_animation():
-        Creates the animation using the update function and a frame rate of 60 FPS.
+    create_animation(fps=30, blit=False):
+        Creates the animation using the update function at the given frame rate.
+
+    save_spectrum_gif(file_name='spectrum.gif', dpi=80, engine='raster', workers=None):
+        Saves random frames of the spectrum as a looping GIF.
     """
-    def __init__(self, min_frequency=0, max_frequency=1000, min_amplitude=0, max_amplitude=1000, num_bands=100, visible_bands=[200, 400, 550, 800], noise_floor=[200], num_frames=100):
+    def __init__(self, min_frequency=0, max_frequency=1000, min_amplitude=0, max_amplitude=1000, num_bands=100, visible_bands=[200, 400, 550, 800], noise_floor=[200], num_frames=100, seed=None, renderer='bars', figure_pool=None):
         """
         Constructs all the necessary attributes for the SpectrumAnalyzer object.
 
@@ -76,24 +126,45 @@ class SpectrumAnalyzer:
         self.num_bands = num_bands
         self.visible_bands = visible_bands
         self.noise_floor = noise_floor
-        self.amplitudes = [self.noise_floor[0]] * (self.num_bands)
         self.num_frames = num_frames
+        self.seed = seed
+        self.renderer = renderer
+        self.figure_pool = figure_pool
+        self.frame_rate = FrameRateMeter()
+        self.wiggle_effect = Wiggle(seed=seed)
+        self.shaping_kernel = DEFAULT_SHAPING_KERNEL
         self.create_bar_plot()
 
-    def create_bar_plot(self):
-        base_frequencies = np.linspace(self.min_frequency, self.max_frequency, self.num_bands - len(self.visible_bands), endpoint=False)
+    @property
+    def amplitudes(self):
+        return self.state.amplitudes
 
-        visible_band_indices = []
-        for visible_band in self.visible_bands:
-            closest_index = np.argmin(np.abs(base_frequencies - visible_band))
-            visible_band_indices.append(closest_index)
+    @amplitudes.setter
+    def amplitudes(self, amplitudes):
+        self.state.amplitudes[:] = amplitudes
 
-        for i, index in enumerate(visible_band_indices):
-            base_frequencies = np.insert(base_frequencies, index + i, self.visible_bands[i])
+    def build_bands(self):
+        """
+        Sizes the band state and the frame generator for the current number of
+        bands, amplitude range and noise floor, and builds the frequency grid
+        with the visible bands merged in.
 
-        self.frequencies = base_frequencies
+        Called again whenever those options change, so that nothing keeps
+        producing frames for the old grid.
+        """
+        self.state = AnalyzerState(self.num_bands, self.noise_floor[0])
+        self.frame_generator = FrameGenerator(self.num_bands, self.min_amplitude, self.max_amplitude, seed=self.seed)
+        self.frequencies, self.visible_band_indices = shared_frequency_grid(self.min_frequency, self.max_frequency, self.num_bands, self.visible_bands)
+        self.band_index = BandIndex(self.frequencies)
+        self.state.set_flag(list(self.visible_band_indices.values()), VISIBLE)
 
-        self.fig, self.ax = plt.subplots()
+    def create_bar_plot(self):
+        self.build_bands()
+
+        if self.figure_pool is not None:
+            self.fig, self.ax = self.figure_pool.checkout()
+        else:
+            self.fig, self.ax = new_figure()
         # self.ax.spines['top'].set_visible(False)
         # self.ax.spines['right'].set_visible(False)
         # self.ax.spines['bottom'].set_visible(False)
@@ -101,10 +172,10 @@ class SpectrumAnalyzer:
         # self.fig.set_figheight(20)
         # self.fig.set_figwidth(20)
 
-        self.bar_plot = self.ax.bar(self.frequencies, self.noise_floor * (self.num_bands), color='red', width=[5] * (self.num_bands))
+        self.draw_bars()
 
-        plt.ylim((0,1000))
-        plt.xlim((self.min_frequency-100, self.max_frequency+100))
+        self.ax.set_ylim((0,1000))
+        self.ax.set_xlim((self.min_frequency-100, self.max_frequency+100))
 
         self.ax.set_title('Spectrum Analyzer')
         self.ax.set_xlabel('Frequency (Hz)')
@@ -112,11 +183,99 @@ class SpectrumAnalyzer:
 
         self.ax.set_xticks(self.visible_bands)
 
+    def release_figure(self):
+        """
+        Returns the plot's figure to figure_pool once it is no longer needed.
+
+        Does nothing when the figure was not taken from a pool.
+        """
+        if self.figure_pool is not None and self.fig is not None:
+            self.figure_pool.checkin(self.fig)
+            self.fig = self.ax = self.bar_plot = None
+
+    def set_emitter(self, frequency, transmitting=True):
+        """
+        Marks the band nearest to frequency as transmitting alongside the
+        selected band, so update_label shapes its adjacent bands too.
+
+        Parameters
+        ----------
+        frequency : int
+            the frequency of the band
+        transmitting : bool
+            whether the band is transmitting
+        """
+        self.state.set_flag(self.band_index.lookup(frequency), EMITTER, transmitting)
+
+    def set_threshold(self, frequency, threshold):
+        """
+        Sets the amplitude at which the band nearest to frequency turns green.
+
+        Parameters
+        ----------
+        frequency : int
+            the frequency of the band
+        threshold : int
+            the threshold, or None to stop monitoring the band
+        """
+        self.state.thresholds[self.band_index.lookup(frequency)] = np.inf if threshold is None else threshold
+
+    def update_colors(self):
+        """
+        Recolors every band by whether its amplitude has reached its threshold.
+
+        Bands at or over their threshold are green and, with the bars renderer,
+        drawn on top. The collection renderer gets all colors in a single
+        facecolor update, the bars renderer only touches bars whose state changed.
+        """
+        was_alert = (self.state.flags & ALERT).astype(bool)
+        _, alert = threshold_colors(self.state.amplitudes, self.state.thresholds, out=self.state.colors)
+        self.state.set_flag(alert, ALERT)
+        self.state.set_flag(~alert, ALERT, False)
+
+        if isinstance(self.bar_plot, BarCollection):
+            self.bar_plot.set_colors(self.state.colors)
+        else:
+            for index in np.flatnonzero(alert != was_alert):
+                self.bar_plot[index].set_color(self.state.colors[index])
+                self.bar_plot[index].set_zorder(100 if alert[index] else 1)
+
+    def draw_bars(self):
+        """
+        Draws one bar per band on the noise floor using the configured renderer.
+        """
+        if self.renderer == 'collection':
+            self.bar_plot = BarCollection(self.ax, self.frequencies, self.state.amplitudes, width=5, color=self.state.colors)
+        else:
+            self.bar_plot = self.ax.bar(self.frequencies, self.state.amplitudes, color=self.state.colors, width=5)
+
+    def set_bar_heights(self, heights):
+        """
+        Sets the height of every bar in the plot.
+
+        Parameters
+        ----------
+        heights : array of int
+            the new height of each bar
+        """
+        if isinstance(self.bar_plot, BarCollection):
+            self.bar_plot.set_heights(heights)
+        else:
+            for rect, h in zip(self.bar_plot, heights):
+                rect.set_height(h)
+
+    def animated_artists(self):
+        """
+        Returns the artists that change from frame to frame, in drawing order.
+        """
+        if isinstance(self.bar_plot, BarCollection):
+            return [self.bar_plot.collection]
+        return sorted(self.bar_plot, key=lambda rect: rect.get_zorder())
+
     def update_bars(self, i):
-        new_amplitudes = [random.randint(self.min_amplitude, self.max_amplitude) for _ in range(self.num_bands)]
+        new_amplitudes = self.frame_generator.next_frame()
 
-        for bar, amplitude in zip(self.bar_plot, new_amplitudes):
-            bar.set_height(amplitude)
+        self.set_bar_heights(new_amplitudes)
 
         #return self.bar_plot
         return self.frequencies, new_amplitudes
@@ -130,12 +289,14 @@ class SpectrumAnalyzer:
         """
         Sets the currently selected band to the given frequency.
 
+        If no band sits exactly on the frequency the nearest band is selected.
+
         Parameters
         ----------
         selected_band : int
             the frequency of the selected band
         """
-        self.selected_band = np.where(self.frequencies == selected_band)[0][0]
+        self.selected_band = self.band_index.lookup(selected_band)
     
     def submit_init_options(self):
         """
@@ -172,26 +333,19 @@ class SpectrumAnalyzer:
         """
         Creates the frame for the spectrum analyzer plot.
         """
+        # tkinter is only imported here so headless users of this module never load it
+        import tkinter as tk
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         self.root = tk.Tk()
         self.plot_frame = tk.Frame(self.root)
         self.plot_frame.winfo_toplevel().title('Spectrum Analyzer')
         self.plot_frame.pack()
-        base_frequencies = np.linspace(self.min_frequency, self.max_frequency, self.num_bands - len(self.visible_bands), endpoint=False)
-
-        # Create a list of visible bands with closest frequencies in base_frequencies
-        visible_band_indices = []
-        for visible_band in self.visible_bands:
-            closest_index = np.argmin(np.abs(base_frequencies - visible_band))
-            visible_band_indices.append(closest_index)
-
-        # Insert visible bands into the base_frequencies array
-        for i, index in enumerate(visible_band_indices):
-            base_frequencies = np.insert(base_frequencies, index + i, self.visible_bands[i])
-
-        self.frequencies = base_frequencies
+        # Size the band state and frame generator for the chosen options and rebuild the grid
+        self.build_bands()
         
         # Remove the borders from the Spectrum Analyzer frame
-        self.fig, self.ax = plt.subplots()
+        self.fig, self.ax = new_figure()
         self.ax.spines['top'].set_visible(False)
         self.ax.spines['right'].set_visible(False)
         self.ax.spines['bottom'].set_visible(False)
@@ -200,11 +354,11 @@ class SpectrumAnalyzer:
         self.fig.set_figwidth(20)
         
         # Create the bar plot
-        self.bar_plot = self.ax.bar(self.frequencies, self.noise_floor * (self.num_bands), color='red', width=[5] * (self.num_bands))
+        self.draw_bars()
 
         # Set the x/y axis limits
-        plt.ylim((0,1000))
-        plt.xlim((self.min_frequency-100, self.max_frequency+100))
+        self.ax.set_ylim((0,1000))
+        self.ax.set_xlim((self.min_frequency-100, self.max_frequency+100))
         
         # Set plot labels
         self.ax.set_title('Spectrum Analyzer')
@@ -215,8 +369,7 @@ class SpectrumAnalyzer:
         self.ax.set_xticks(self.visible_bands)
         
         # Create the FigureCanvasTkAgg widget and add it to the plot frame
-        print(np.where(self.frequencies == self.visible_bands[0])[0])
-        self.selected_band = np.where(self.frequencies == self.visible_bands[0])[0][0]
+        self.selected_band = self.visible_band_indices[self.visible_bands[0]]
         self.canvas = FigureCanvasTkAgg(self.fig, self.plot_frame)
         self.canvas.get_tk_widget().pack()
   
@@ -243,14 +396,8 @@ class SpectrumAnalyzer:
         frame : int
             The current frame of the animation.
         """
-        num_bars_to_wiggle = int(len(self.bar_plot) * 0.1)  # Determine number of bars to wiggle
-        bars_to_wiggle = np.random.choice(len(self.bar_plot), num_bars_to_wiggle, replace=False)  # Select random bars to wiggle
-        wiggle_amount = 10 * np.sin(frame / 100 * 2 * np.pi) # Calculate a sine wave with period 100 frames and amplitude 10 pixels        
-        for i, rect in enumerate(self.bar_plot):
-            if i in bars_to_wiggle:
-                rect.set_height(max(0, int(self.amplitudes[i] + int(wiggle_amount))))
-            else:
-                rect.set_height(max(0, int(self.amplitudes[i])))
+        heights = self.wiggle_effect.apply(self.state.amplitudes, frame, out=self.state.heights)
+        self.set_bar_heights(heights)
 
     def update(self, frame):
         """
@@ -261,12 +408,11 @@ class SpectrumAnalyzer:
         frame : int
             the current frame of the animation
         """
-        heights = np.maximum(0, self.amplitudes)
-        for rect, h in zip(self.bar_plot, heights):
-            rect.set_height(h)
+        # wiggle sets every bar's height, clipped at zero
         self.wiggle(frame)
+        self.frame_rate.tick()
         self.update_label()
-        return self.bar_plot,
+        return self.animated_artists()
     
     def update_label(self):
         """
@@ -278,48 +424,84 @@ class SpectrumAnalyzer:
         else:
             amplitude = self.amplitudes[self.selected_band]
         # Update the label with the selected band and frequency
-        self.label.configure(text=f'Selected Band\nFrequency: {self.frequencies[self.selected_band]} Hz\nAmplitude: {self.amplitudes[self.selected_band]}')
+        self.label.configure(text=f'Selected Band\nFrequency: {self.frequencies[self.selected_band]} Hz\nAmplitude: {self.amplitudes[self.selected_band]:g}\nFPS: {self.frame_rate.fps:.1f}')
 
-        # Update the color of the bar based on the amplitude
+        # The selected band is monitored at the transmit strength
         try: 
-            if amplitude >= self.transmit_strength:
-                self.bar_plot[self.selected_band].set_color('green')
-                self.bar_plot[self.selected_band].set_zorder(100)
-            else:
-                self.bar_plot[self.selected_band].set_color('red')
-        except TypeError:
+            self.state.thresholds[self.selected_band] = self.transmit_strength
+        except (TypeError, ValueError):
             self.transmit_strength = 500
-            if amplitude >= self.transmit_strength:
-                self.bar_plot[self.selected_band].set_color('green')
-                self.bar_plot[self.selected_band].set_zorder(100)
-            else:
-                self.bar_plot[self.selected_band].set_color('red')
+            self.state.thresholds[self.selected_band] = self.transmit_strength
+        self.update_colors()
             
-        # Update the amplitudes of the adjacent bars
-        band_list = range(1,5)
-        band_variance = [0.9, 0.95, 0.9, 0.8, 0.6]
-        for i in band_list:
-            adjacent_bands = [self.selected_band-i, self.selected_band+i]
-            for band in adjacent_bands:
-                if 0 <= band < len(self.amplitudes):
-                    if self.amplitudes[self.selected_band] * band_variance[i] >= self.noise_floor[0]:
-                        self.amplitudes[band] = self.amplitudes[self.selected_band] * band_variance[i]
-                if self.amplitudes[self.selected_band] <= self.noise_floor[0]:
-                    self.amplitudes[band] = self.noise_floor[0]
+        # Update the amplitudes of the bars adjacent to every transmitting band
+        sources = self.state.flagged(EMITTER).tolist() + [self.selected_band]
+        shape_bands(self.state.amplitudes, sources, self.shaping_kernel, self.state.noise_floor, out=self.state.amplitudes)
     
-    def create_animation(self):
+    def create_animation(self, fps=30, blit=False):
+        """
+        Creates the animation using the update function at the given frame rate.
+
+        With blit enabled the bars are marked as animated, so the axes, labels and
+        title are rendered once into a cached background (and again whenever the
+        window is resized) and only the bars are redrawn each frame. The rate
+        actually achieved is shown in the label and kept in frame_rate.
+
+        Parameters
+        ----------
+        fps : int
+            the target frame rate
+        blit : bool
+            whether to redraw only the bars on top of a cached background
         """
-        Creates the animation using the update function and a frame rate of 60 FPS.
+        if blit:
+            for artist in self.animated_artists():
+                artist.set_animated(True)
+        self.ani = animation.FuncAnimation(self.fig, self.update, interval=1000/fps, blit=blit, cache_frame_data=False)
+
+    def save_spectrum_gif(self, file_name='spectrum.gif', dpi=80, engine='raster', workers=None, progress=None, optimize=False):
         """
-        self.ani = animation.FuncAnimation(self.fig, self.update, interval=1000/30)
+        Saves num_frames random frames of the spectrum as a looping animation.
+
+        With the raster engine the frames are generated and written one block
+        at a time, so memory use does not grow with num_frames, and the format
+        follows the extension of file_name: .gif, .png or .apng for an animated
+        PNG, or .webp.
 
-    def save_spectrum_gif(self, file_name='spectrum.gif', dpi=80):
-        fig, ax = plt.subplots()
+        Parameters
+        ----------
+        file_name : str
+            path of the animation to write
+        dpi : int
+            dots per inch of the frames
+        engine : str
+            'raster' draws the bars straight into the image with NumPy on top
+            of axes rendered once, 'matplotlib' redraws the whole figure for
+            every frame and only writes GIFs
+        workers : int, optional
+            number of processes the raster engine encodes frames with, the
+            file is identical for any number of workers
+        progress : callable, optional
+            called as progress(frames_written, num_frames) after every frame
+            written by the raster engine
+        optimize : bool
+            write a GIF with a fixed 16 color palette in which each frame only
+            holds the pixels that changed since the frame before, raster
+            engine only
+        """
+        if engine == 'raster':
+            frames = self.frame_generator.frames(self.num_frames)
+            # 14 template colors plus the bar and transparent entries fill a 16 color palette
+            rasterizer = BarRasterizer(self.frequencies, self.max_amplitude, dpi=dpi, colors=14 if optimize else 254)
+            save_animation(file_name, frames, rasterizer, fps=20, workers=workers, progress=progress, total=self.num_frames, optimize=optimize)
+            return
+
+        frames = self.frame_generator.block(self.num_frames)
+        fig, ax = new_figure()
     
         def update_spectrum_plot(frame):
-            freqs, amplitudes = self.update_bars(frame)
             ax.clear()
-            ax.bar(freqs, amplitudes)
+            ax.bar(self.frequencies, frames[frame])
             ax.set_xlabel("Frequency [Hz]")
             ax.set_ylabel("Amplitude")
             ax.set_title("Frequency Spectrum")
@@ -327,9 +509,9 @@ class SpectrumAnalyzer:
         ani = FuncAnimation(fig, update_spectrum_plot, frames=self.num_frames, interval=50, blit=False)
 
         writer = PillowWriter(fps=20)
-        ani.save(file_name, writer=writer, dpi=dpi)
-
-        plt.close(fig)
+        # Draws every frame, so it must not overlap with renders in other threads
+        with DRAW_LOCK:
+            ani.save(file_name, writer=writer, dpi=dpi)
 
 if __name__ == '__main__':
     # Example usage
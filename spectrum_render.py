@@ -0,0 +1,334 @@
+import io
+import threading
+import time
+from collections import defaultdict, deque
+
+import matplotlib as mpl
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.colors import to_rgba, to_rgba_array
+from matplotlib.figure import Figure
+
+# Matplotlib does not promise that drawing is thread-safe, text layout and the
+# font cache are shared by every figure. Everything in this process that draws
+# a figure holds this lock while it does.
+DRAW_LOCK = threading.RLock()
+
+
+def new_figure(figsize=None, dpi=None):
+    """
+    Creates a figure with one axes on an Agg canvas.
+
+    The figure is not registered with pyplot, so nothing keeps it alive once the
+    caller drops it. Drawing it from a thread other than the GUI's must hold
+    DRAW_LOCK, as render_image does. A GUI can still show it by attaching its
+    own canvas, e.g. FigureCanvasTkAgg.
+
+    Parameters
+    ----------
+    figsize : (float, float), optional
+        width and height in inches, defaults to rcParams['figure.figsize']
+    dpi : float, optional
+        dots per inch, defaults to rcParams['figure.dpi']
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+    ax : matplotlib.axes.Axes
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    return fig, ax
+
+
+def render_image(fig, format='png', dpi=None):
+    """
+    Renders a figure and returns the encoded image bytes, holding DRAW_LOCK so
+    that renders from several threads do not draw at the same time.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        the figure to render
+    format : str
+        any format savefig supports, e.g. 'png' or 'jpeg'
+    dpi : float, optional
+        dots per inch, defaults to the figure's own
+    """
+    buf = io.BytesIO()
+    with DRAW_LOCK:
+        fig.savefig(buf, format=format, dpi=dpi)
+    return buf.getvalue()
+
+
+class FigurePool:
+    """
+    A thread-safe pool of pre-built figures, keyed by size and DPI.
+
+    Checking a figure out hands over an idle one when there is one and builds a
+    new one otherwise. Checking it back in removes everything drawn on its
+    axes and keeps it for the next caller, up to max_idle figures per key, so
+    memory stays flat however many requests are served.
+
+    ...
+
+    Attributes
+    ----------
+    max_idle : int
+        maximum number of idle figures kept for each size and DPI
+    created : int
+        number of figures built by the pool
+    reused : int
+        number of checkouts served by an idle figure
+
+    Methods
+    -------
+    checkout(figsize=None, dpi=None):
+        Returns an empty (fig, ax) pair of the given size and DPI.
+
+    checkin(fig):
+        Clears a figure and returns it to the pool.
+
+    prewarm(count, figsize=None, dpi=None):
+        Builds idle figures ahead of the first requests.
+    """
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(figsize, dpi):
+        figsize = tuple(mpl.rcParams['figure.figsize'] if figsize is None else figsize)
+        dpi = mpl.rcParams['figure.dpi'] if dpi is None else dpi
+        return figsize, dpi
+
+    def checkout(self, figsize=None, dpi=None):
+        """
+        Returns an empty (fig, ax) pair of the given size and DPI.
+
+        Parameters
+        ----------
+        figsize : (float, float), optional
+            width and height in inches, defaults to rcParams['figure.figsize']
+        dpi : float, optional
+            dots per inch, defaults to rcParams['figure.dpi']
+        """
+        key = self._key(figsize, dpi)
+        with self._lock:
+            if self._idle[key]:
+                self.reused += 1
+                fig = self._idle[key].pop()
+                return fig, fig.axes[0]
+            self.created += 1
+        return new_figure(*key)
+
+    def checkin(self, fig):
+        """
+        Removes everything drawn on the figure's axes and returns it to the pool.
+
+        Titles, labels, limits and ticks are left as they are, whoever checks
+        the figure out next sets their own.
+
+        Parameters
+        ----------
+        fig : matplotlib.figure.Figure
+            a figure previously returned by checkout
+        """
+        ax = fig.axes[0]
+        for container in list(ax.containers):
+            container.remove()
+        for artist in [*ax.collections, *ax.patches, *ax.lines, *ax.texts, *ax.images]:
+            artist.remove()
+
+        key = self._key(tuple(fig.get_size_inches()), fig.dpi)
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(fig)
+
+    def prewarm(self, count, figsize=None, dpi=None):
+        """
+        Builds up to count idle figures of the given size and DPI.
+        """
+        key = self._key(figsize, dpi)
+        while True:
+            with self._lock:
+                if len(self._idle[key]) >= min(count, self.max_idle):
+                    return
+                self.created += 1
+            fig, _ = new_figure(*key)
+            with self._lock:
+                self._idle[key].append(fig)
+
+    def stats(self):
+        """
+        Returns the idle, created and reused counts of the pool as a dict.
+        """
+        with self._lock:
+            return {'idle': sum(len(figs) for figs in self._idle.values()), 'created': self.created, 'reused': self.reused}
+
+
+class BarCollection:
+    """
+    Draws every bar of the spectrum as one PolyCollection.
+
+    Each bar is a rectangle whose vertices live in a single (num_bands, 5, 2)
+    array. The paths of the collection are views into that array, so new
+    heights are written in place without creating any artists.
+
+    ...
+
+    Attributes
+    ----------
+    collection : matplotlib.collections.PolyCollection
+        the artist added to the axes
+    vertices : numpy.ndarray
+        float array of shape (num_bands, 5, 2) holding the corners of every bar
+    facecolors : numpy.ndarray
+        RGBA array of shape (num_bands, 4) holding the color of every bar
+
+    Methods
+    -------
+    set_heights(heights):
+        Sets the height of every bar from an amplitude vector.
+
+    set_colors(colors):
+        Sets the color of every bar.
+    """
+    def __init__(self, ax, frequencies, heights, width=5, color='red'):
+        """
+        Builds the vertex and color arrays and adds the collection to ax.
+
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes
+            the axes to draw the bars on
+        frequencies : array of float
+            center frequency of each bar
+        heights : array of float
+            initial height of each bar
+        width : float
+            width of each bar in Hz
+        color : color or array of colors
+            initial color of every bar, or of each bar
+        """
+        frequencies = np.asarray(frequencies, dtype=float)
+        left = frequencies - width / 2
+        right = frequencies + width / 2
+
+        # Corners run bottom-left, top-left, top-right, bottom-right and back
+        # to bottom-left, so the top edge is vertices[:, 1:3, 1].
+        self.vertices = np.zeros((len(frequencies), 5, 2))
+        self.vertices[:, [0, 1, 4], 0] = left[:, np.newaxis]
+        self.vertices[:, [2, 3], 0] = right[:, np.newaxis]
+
+        self.facecolors = np.empty((len(frequencies), 4))
+        self.facecolors[:] = to_rgba_array(color)
+
+        self.collection = PolyCollection([], closed=False, facecolors=self.facecolors, edgecolors='none')
+        # closed=False makes each path a view into self.vertices rather than a copy
+        self.collection.set_verts(self.vertices, closed=False)
+        self.set_heights(heights)
+        ax.add_collection(self.collection)
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def set_heights(self, heights):
+        """
+        Sets the height of every bar.
+
+        Parameters
+        ----------
+        heights : array of float
+            new height of each bar
+        """
+        self.vertices[:, 1:3, 1] = np.asarray(heights)[:, np.newaxis]
+        self.collection.stale = True
+
+    def set_colors(self, colors):
+        """
+        Sets the color of every bar.
+
+        Parameters
+        ----------
+        colors : color or array of colors
+            a single color for all bars, or one color per bar
+        """
+        self.facecolors[:] = to_rgba_array(colors)
+        self.collection.set_facecolor(self.facecolors)
+
+
+class FrameRateMeter:
+    """
+    Measures the achieved frame rate over a sliding window of recent frames.
+
+    ...
+
+    Attributes
+    ----------
+    window : int
+        number of recent frames the rate is averaged over
+
+    Methods
+    -------
+    tick():
+        Records that a frame has been drawn.
+
+    fps:
+        The achieved frames per second, 0.0 until two frames have been seen.
+    """
+    def __init__(self, window=60):
+        self.window = window
+        self._timestamps = deque(maxlen=window)
+
+    def tick(self):
+        """
+        Records that a frame has been drawn.
+        """
+        self._timestamps.append(time.perf_counter())
+
+    @property
+    def fps(self):
+        if len(self._timestamps) < 2:
+            return 0.0
+        elapsed = self._timestamps[-1] - self._timestamps[0]
+        if elapsed <= 0:
+            return 0.0
+        return (len(self._timestamps) - 1) / elapsed
+
+
+def threshold_colors(amplitudes, thresholds, below='red', above='green', out=None):
+    """
+    Colors every band by whether its amplitude has reached its threshold.
+
+    Parameters
+    ----------
+    amplitudes : array of float
+        the amplitude of each band
+    thresholds : array of float
+        the threshold of each band, np.inf for bands that are not monitored
+    below : color
+        color of bands under their threshold
+    above : color
+        color of bands at or over their threshold
+    out : numpy.ndarray, optional
+        (num_bands, 4) RGBA array to write the colors into
+
+    Returns
+    -------
+    colors : numpy.ndarray
+        RGBA color of each band
+    alert : numpy.ndarray
+        boolean mask of the bands at or over their threshold
+    """
+    alert = np.asarray(amplitudes) >= np.asarray(thresholds)
+    if out is None:
+        out = np.empty((len(alert), 4))
+    out[:] = to_rgba(below)
+    out[alert] = to_rgba(above)
+    return out, alert